@@ -0,0 +1,297 @@
+import java.io.BufferedReader;
+import java.io.BufferedWriter;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintWriter;
+import java.util.Map;
+import java.util.StringTokenizer;
+
+import org.sat4j.core.VecInt;
+import org.sat4j.minisat.SolverFactory;
+import org.sat4j.reader.DimacsReader;
+import org.sat4j.reader.ParseFormatException;
+import org.sat4j.specs.ContradictionException;
+import org.sat4j.specs.IProblem;
+import org.sat4j.specs.ISolver;
+import org.sat4j.specs.TimeoutException;
+
+// Long-lived SAT4J process driven by sudokub.py over stdin/stdout.
+//
+// Every request is one line, every answer ends with a line "end":
+//   ping          -> pong
+//   solve <file>  -> the s/v lines SAT4J prints for the DIMACS file
+//   solve         -> same for the DIMACS formula sent right after the request
+//   load <file>   -> ok, loads the DIMACS file in the incremental session
+//   load          -> same for the DIMACS formula sent right after the request
+//   add <lits> 0  -> ok, adds a clause to the session
+//   assume <lits> 0 -> s/v lines for the session under these assumptions
+//   timeout <ms>  -> ok, the searches of the next solve/assume requests stop
+//                    after ms milliseconds with "s UNKNOWN" (0: no deadline)
+//   quit          -> stops the process
+//
+// Every s line is preceded by "c <name> : <value>" lines with the statistics
+// of the solver (conflicts, decisions, propagations...).
+//
+// The session keeps its learned clauses from one "assume" to the next.
+//
+// When the JVM runs out of memory (java -Xmx...), the current request answers
+// "s UNKNOWN" and the process stops: sudokub.py starts a new one.
+//
+// Build: javac -cp org.sat4j.core.jar SatServer.java
+// Run:   java -cp org.sat4j.core.jar:. SatServer
+public class SatServer {
+
+    static ISolver session = null;
+    static boolean contradiction = false;
+    static long timeoutMs = 0;
+
+    public static void main(String[] args) throws IOException {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        PrintWriter out = new PrintWriter(new BufferedWriter(new OutputStreamWriter(System.out)));
+        String line;
+        while ((line = in.readLine()) != null) {
+            line = line.trim();
+            if (line.equals("quit")) {
+                break;
+            }
+            try {
+                request(line, in, out);
+            } catch (OutOfMemoryError e) {
+                session = null;
+                out.println("c out of memory");
+                out.println("s UNKNOWN");
+                out.println("end");
+                break;
+            }
+            out.println("end");
+            out.flush();
+        }
+        out.flush();
+    }
+
+    static void request(String line, BufferedReader in, PrintWriter out) throws IOException {
+        if (line.equals("ping")) {
+            out.println("pong");
+        } else if (line.equals("solve")) {
+            solve(in, out);
+        } else if (line.startsWith("solve ")) {
+            solve(line.substring(6), out);
+        } else if (line.equals("load")) {
+            load(in, out);
+        } else if (line.startsWith("load ")) {
+            load(line.substring(5), out);
+        } else if (line.startsWith("add ")) {
+            add(literals(line.substring(4)), out);
+        } else if (line.startsWith("assume ")) {
+            assume(literals(line.substring(7)), out);
+        } else if (line.startsWith("timeout ")) {
+            timeoutMs = Long.parseLong(line.substring(8).trim());
+            out.println("ok");
+        } else {
+            out.println("c unknown request: " + line);
+        }
+    }
+
+    // applies the deadline of the timeout request to a solver
+    static void deadline(ISolver solver) {
+        if (timeoutMs > 0) {
+            solver.setTimeoutMs(timeoutMs);
+        } else {
+            solver.setTimeout(Integer.MAX_VALUE);
+        }
+    }
+
+    static void solve(String filename, PrintWriter out) {
+        ISolver solver = SolverFactory.newDefault();
+        deadline(solver);
+        DimacsReader reader = new DimacsReader(solver);
+        try {
+            IProblem problem = reader.parseInstance(filename);
+            boolean satisfiable = problem.isSatisfiable();
+            printStats(solver, out);
+            if (satisfiable) {
+                out.println("s SATISFIABLE");
+                printModel(problem.model(), out);
+            } else {
+                out.println("s UNSATISFIABLE");
+            }
+        } catch (ContradictionException e) {
+            out.println("s UNSATISFIABLE");
+        } catch (TimeoutException e) {
+            out.println("c timeout");
+            out.println("s UNKNOWN");
+        } catch (ParseFormatException e) {
+            out.println("c " + e.getMessage());
+            out.println("s UNKNOWN");
+        } catch (IOException e) {
+            out.println("c " + e.getMessage());
+            out.println("s UNKNOWN");
+        }
+    }
+
+    static void solve(BufferedReader in, PrintWriter out) throws IOException {
+        ISolver solver = SolverFactory.newDefault();
+        deadline(solver);
+        try {
+            readFormula(in, solver);
+            boolean satisfiable = solver.isSatisfiable();
+            printStats(solver, out);
+            if (satisfiable) {
+                out.println("s SATISFIABLE");
+                printModel(solver.model(), out);
+            } else {
+                out.println("s UNSATISFIABLE");
+            }
+        } catch (ContradictionException e) {
+            out.println("s UNSATISFIABLE");
+        } catch (TimeoutException e) {
+            out.println("c timeout");
+            out.println("s UNKNOWN");
+        }
+    }
+
+    static void load(BufferedReader in, PrintWriter out) throws IOException {
+        session = SolverFactory.newDefault();
+        contradiction = false;
+        try {
+            readFormula(in, session);
+        } catch (ContradictionException e) {
+            contradiction = true;
+        }
+        out.println("ok");
+    }
+
+    // reads a DIMACS formula from the request stream, up to its last clause as
+    // announced by the "p cnf" line; all of it is read even after a contradiction
+    static void readFormula(BufferedReader in, ISolver solver) throws IOException, ContradictionException {
+        String line;
+        int clauses = -1;
+        while (clauses < 0 && (line = in.readLine()) != null) {
+            line = line.trim();
+            if (line.startsWith("p")) {
+                String[] header = line.split("\\s+");
+                solver.newVar(Integer.parseInt(header[2]));
+                clauses = Integer.parseInt(header[3]);
+                solver.setExpectedNumberOfClauses(clauses);
+            }
+        }
+        boolean contradiction = false;
+        VecInt clause = new VecInt();
+        while (clauses > 0 && (line = in.readLine()) != null) {
+            StringTokenizer tokens = new StringTokenizer(line);
+            while (tokens.hasMoreTokens()) {
+                int lit = Integer.parseInt(tokens.nextToken());
+                if (lit != 0) {
+                    clause.push(lit);
+                    continue;
+                }
+                try {
+                    solver.addClause(clause);
+                } catch (ContradictionException e) {
+                    contradiction = true;
+                }
+                clause = new VecInt();
+                clauses--;
+            }
+        }
+        if (contradiction) {
+            throw new ContradictionException();
+        }
+    }
+
+    static void load(String filename, PrintWriter out) {
+        session = SolverFactory.newDefault();
+        contradiction = false;
+        try {
+            new DimacsReader(session).parseInstance(filename);
+        } catch (ContradictionException e) {
+            contradiction = true;
+        } catch (ParseFormatException e) {
+            out.println("c " + e.getMessage());
+        } catch (IOException e) {
+            out.println("c " + e.getMessage());
+        }
+        out.println("ok");
+    }
+
+    static void add(VecInt clause, PrintWriter out) {
+        if (session == null) {
+            out.println("c no formula loaded");
+            return;
+        }
+        int max = 0;
+        for (int i = 0; i < clause.size(); i++) {
+            max = Math.max(max, Math.abs(clause.get(i)));
+        }
+        if (max > session.nVars()) {
+            session.newVar(max);
+        }
+        try {
+            session.addClause(clause);
+        } catch (ContradictionException e) {
+            contradiction = true;
+        }
+        out.println("ok");
+    }
+
+    static void assume(VecInt assumptions, PrintWriter out) {
+        if (session == null) {
+            out.println("c no formula loaded");
+            out.println("s UNKNOWN");
+            return;
+        }
+        if (contradiction) {
+            out.println("s UNSATISFIABLE");
+            return;
+        }
+        deadline(session);
+        try {
+            boolean satisfiable = session.isSatisfiable(assumptions);
+            printStats(session, out);
+            if (satisfiable) {
+                out.println("s SATISFIABLE");
+                printModel(session.model(), out);
+            } else {
+                out.println("s UNSATISFIABLE");
+            }
+        } catch (TimeoutException e) {
+            out.println("c timeout");
+            out.println("s UNKNOWN");
+        }
+    }
+
+    // parses "l1 l2 ... 0"
+    static VecInt literals(String line) {
+        VecInt literals = new VecInt();
+        for (String token : line.trim().split("\\s+")) {
+            int lit = Integer.parseInt(token);
+            if (lit == 0) {
+                break;
+            }
+            literals.push(lit);
+        }
+        return literals;
+    }
+
+    // statistics of the solver, "c <name> : <value>" (cumulated over a session)
+    static void printStats(ISolver solver, PrintWriter out) {
+        for (Map.Entry<String, Number> stat : solver.getStat().entrySet()) {
+            out.println("c " + stat.getKey() + " : " + stat.getValue());
+        }
+    }
+
+    // the model on "v" lines of at most 1000 literals, the last one ends with 0
+    static void printModel(int[] model, PrintWriter out) {
+        StringBuilder line = new StringBuilder("v");
+        for (int i = 0; i < model.length; i++) {
+            line.append(' ').append(model[i]);
+            if (i % 1000 == 999) {
+                out.println(line);
+                line = new StringBuilder("v");
+            }
+        }
+        line.append(" 0");
+        out.println(line);
+    }
+}
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sudokub
+
+# benchmarks of sudokub.py over the bundled puzzles
+#   ./sudokub-bench.py run [<directory or glob> ...]: measures every puzzle, writes JSON
+#   ./sudokub-bench.py compare <old>.json <new>.json: flags the regressions of new
+
+CORPORA = ["sudoku9x9", "sudoku16x16", "sudoku25x25"]
+
+# solves one puzzle step by step (scenario "solve"), and checks the uniqueness
+# of its solution (scenario "unique"), timing every step; the solves go through
+# the session of -s and -u (for SAT4J, the formula is loaded once in the worker
+# and the clues are assumptions), the scenario "unique" also times the
+# incremental query of the generator (sudoku_unique_incremental) with SAT4J
+def bench_puzzle(filename, scenario, backend, preprocess, encoding):
+    record = {"puzzle": filename, "scenario": scenario}
+    begin = start = time.perf_counter()
+    sudoku = sudokub.sudoku_read(filename)
+    record["size"] = len(sudoku)
+    record["read_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cnf, clues = sudokub.sudoku_prepare(sudoku, preprocess, encoding)
+    record["encode_s"] = time.perf_counter() - start
+    record["nvars"] = 0 if cnf is None else cnf.nvars
+    record["nclauses"] = 0 if cnf is None else cnf.nclauses + len(clues)
+    record["bytes"] = 0
+    record["send_s"] = 0.0
+    record["solve_s"] = 0.0
+    record["parse_s"] = 0.0
+    record["solves"] = 0
+
+    if cnf is None or cnf.nvars == 0:
+        solution = [] if cnf is None else cnf.board
+        # no solution at all: nothing to be unique
+        unique = None if cnf is None else True
+    else:
+        if backend != "cdcl":
+            record["bytes"] = len("p cnf %d %d\n" % (cnf.nvars, cnf.nclauses)) + sum(map(len, cnf.dimacs_chunks()))
+        session = bench_timed(record, sudokub.sudoku_session, cnf, backend)
+        solution = bench_solve(session, clues, record)
+        unique = None
+        if scenario == "unique" and solution != []:
+            sudokub.sudoku_other_solution_constraint(session, solution, cnf.names, sudoku)
+            unique = bench_solve(session, clues, record) == []
+            if backend == "sat4j":
+                start = time.perf_counter()
+                record["incremental_unique"] = sudokub.sudoku_unique_incremental(sudoku, solution, backend,
+                                                                                 preprocess, encoding)
+                record["incremental_s"] = time.perf_counter() - start
+    record["total_s"] = time.perf_counter() - begin
+    record["solved"] = solution != []
+    if scenario == "unique":
+        record["unique"] = unique
+    return record
+
+# phases of sudokub timed by the benchmark: formatting and transfer of the
+# formula (or building of the CDCL solver), search, decoding of the answer.
+# Without a SAT4J worker, the JVM start and the parse are part of the search
+PHASES = {"send": "send_s", "search": "solve_s", "parse": "parse_s"}
+
+# calls function, adding the time of its phases (sudokub.PROFILE, see bench_run) to record
+def bench_timed(record, function, *args):
+    first = len(sudokub.PROFILE.phases)
+    try:
+        return function(*args)
+    finally:
+        for phase in sudokub.PROFILE.phases[first:]:
+            if phase["name"] in PHASES:
+                record[PHASES[phase["name"]]] += phase["seconds"]
+
+# one solve of the session under the clues
+def bench_solve(session, clues, record):
+    record["solves"] += 1
+    return bench_timed(record, session.solve, clues)
+
+# generation of one puzzle of the given size (scenario "create")
+def bench_create(size, seed, backend, encoding):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sudoku = sudokub.sudoku_generate(size, backend, encoding, 1, seed)
+    seconds = time.perf_counter() - start
+    clues = sum(1 for line in sudoku for number in line if number > 0)
+    return {"puzzle": "generated-" + str(size) + "-" + str(seed), "scenario": "create", "size": size,
+            "seed": seed, "clues": clues, "total_s": seconds}
+
+# aggregates of every (scenario, size) group
+def bench_summary(results):
+    groups = {}
+    for record in results:
+        groups.setdefault(record["scenario"] + "/" + str(record["size"]), []).append(record)
+    summary = {}
+    for key, records in sorted(groups.items()):
+        entry = {"count": len(records)}
+        for metric in ["total_s", "encode_s", "send_s", "solve_s", "parse_s", "incremental_s", "bytes", "nclauses"]:
+            values = [record[metric] for record in records if metric in record]
+            if values:
+                entry[metric + "_median"] = statistics.median(values)
+                entry[metric + "_mean"] = statistics.mean(values)
+                entry[metric + "_max"] = max(values)
+        summary[key] = entry
+    return summary
+
+def bench_run(patterns, options):
+    scenarios = options["--scenarios"].split(",")
+    backend = options["--backend"]
+    preprocess = options["--preprocess"] == "on"
+    encoding = None if options["--encoding"] == "auto" else options["--encoding"]
+    files = []
+    for pattern in patterns:
+        files += sudokub.sudoku_batch_files(pattern)
+    # the phases are read back by bench_timed, the memory is not traced
+    sudokub.PROFILE = sudokub.Profile(memory=False)
+    results = []
+    for repeat in range(int(options["--repeat"])):
+        for scenario in ["solve", "unique"]:
+            if scenario in scenarios:
+                for filename in files:
+                    results.append(bench_puzzle(filename, scenario, backend, preprocess, encoding))
+                    del sudokub.PROFILE.phases[:]
+        if "create" in scenarios:
+            for size in [int(size) for size in options["--create-sizes"].split(",")]:
+                for seed in range(int(options["--create-count"])):
+                    results.append(bench_create(size, seed, backend, encoding))
+                    del sudokub.PROFILE.phases[:]
+    return {"meta": {"backend": backend, "preprocess": preprocess, "encoding": options["--encoding"],
+                     "python": platform.python_version(), "machine": platform.machine(),
+                     "date": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results, "summary": bench_summary(results)}
+
+# medians of new against old: a regression is a slowdown of more than threshold percent
+def bench_compare(old, new, threshold, myfile=sys.stdout):
+    regressions = 0
+    for key in sorted(set(old["summary"]) | set(new["summary"])):
+        if key not in old["summary"] or key not in new["summary"]:
+            myfile.write(key + ": only in one of the files\n")
+            continue
+        for metric in ["total_s_median", "encode_s_median", "send_s_median", "solve_s_median", "parse_s_median",
+                       "incremental_s_median", "bytes_median"]:
+            before = old["summary"][key].get(metric)
+            after = new["summary"][key].get(metric)
+            if before is None or after is None:
+                continue
+            if before == 0:
+                change = 0.0 if after == 0 else float("inf")
+            else:
+                change = 100.0 * (after - before) / before
+            flag = ""
+            if change > threshold and after - before > 1e-4:
+                flag = "  REGRESSION"
+                regressions += 1
+            myfile.write("%-16s %-16s %12.4f -> %12.4f  %+7.1f%%%s\n" % (key, metric, before, after, change, flag))
+    myfile.write(str(regressions) + " regression(s) above " + str(threshold) + "%\n")
+    return regressions
+
+def bench_print(summary, myfile=sys.stdout):
+    for key, entry in summary.items():
+        myfile.write("%-16s %4d puzzles  median %.4fs  max %.4fs\n"
+                     % (key, entry["count"], entry["total_s_median"], entry["total_s_max"]))
+
+OPTIONS = {}
+OPTIONS["--out"] = "bench.json"
+OPTIONS["--backend"] = "sat4j"
+OPTIONS["--preprocess"] = "on"
+OPTIONS["--encoding"] = "auto"
+OPTIONS["--scenarios"] = "solve,unique,create"
+OPTIONS["--repeat"] = "1"
+OPTIONS["--create-sizes"] = "4,9"
+OPTIONS["--create-count"] = "3"
+OPTIONS["--threshold"] = "10"
+
+if __name__ == "__main__":
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--"):
+            name, _, value = arg.partition("=")
+            if name not in OPTIONS or value == "":
+                exit("Bad flag " + arg + "\n")
+            OPTIONS[name] = value
+        else:
+            args.append(arg)
+
+    if len(args) >= 1 and args[0] == "run":
+        here = os.path.dirname(os.path.abspath(__file__))
+        patterns = args[1:] or [os.path.join(here, corpus) for corpus in CORPORA]
+        report = bench_run(patterns, OPTIONS)
+        with open(OPTIONS["--out"], 'w') as myfile:
+            json.dump(report, myfile, indent=1)
+        bench_print(report["summary"])
+        sys.stdout.write("results written to " + OPTIONS["--out"] + "\n")
+    elif len(args) == 3 and args[0] == "compare":
+        with open(args[1]) as myfile:
+            old = json.load(myfile)
+        with open(args[2]) as myfile:
+            new = json.load(myfile)
+        if bench_compare(old, new, float(OPTIONS["--threshold"])) > 0:
+            exit(1)
+    else:
+        sys.stdout.write("./sudokub-bench.py run [<directory or glob> ...]: benchmarks the puzzles\n")
+        sys.stdout.write("     (default: sudoku9x9/, sudoku16x16/ and sudoku25x25/)\n")
+        sys.stdout.write("./sudokub-bench.py compare <old>.json <new>.json: flags regressions of new\n")
+        sys.stdout.write("  options:\n")
+        sys.stdout.write("    --out=<file>.json: results of run (default bench.json)\n")
+        sys.stdout.write("    --backend, --preprocess, --encoding: as for sudokub.py\n")
+        sys.stdout.write("    --scenarios=solve,unique,create: what run measures\n")
+        sys.stdout.write("    --repeat=<n>: number of runs over the puzzles (default 1)\n")
+        sys.stdout.write("    --create-sizes=4,9 --create-count=3: puzzles generated by the create scenario\n")
+        sys.stdout.write("    --threshold=<percent>: slowdown reported as a regression by compare (default 10)\n")
+        exit("Bad arguments\n")
@@ -1,7 +1,273 @@
 #!/usr/bin/python3
 
+import asyncio
+import atexit
+import contextlib
+import functools
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import lzma
+import math
+import mmap
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import signal
+import sqlite3
 import sys
 import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+
+# optional: the generic clauses are built with NumPy when it is installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# raised for a puzzle that cannot be read; when reading a stream of puzzles,
+# only the bad record is reported and the reading goes on
+class SudokuFormatError(ValueError):
+    pass
+
+# raised when the SAT solver gives no definitive answer: deadline reached, memory
+# cap hit, or solver gone; partial is the grid with the cells found by propagation
+class SudokuUnknown(Exception):
+    def __init__(self, message, partial=None):
+        super().__init__(message)
+        self.partial = partial
+
+# the sizes supported: N = n * n for any n >= 2, i.e. 4, 9, 16, 25, 36, 49, 64...
+def sudoku_valid_size(N):
+    return N >= 4 and math.isqrt(N) ** 2 == N
+
+# a sudoku as a flat array of its N*N cells (0 for an empty cell) that keeps,
+# for every row, column and block, how many times it holds every number and
+# the bitmask of the numbers it holds (bit k-1 for k), so that the candidates
+# of a cell, the number of clues and the number of conflicts are answered
+# without scanning the grid. It reads like the list of its rows (len, iteration,
+# board[i][j], comparison with lists of lists), the rows being tuples so that
+# board[i][j] = number fails: set() is the only way to change a cell, and
+# tolist() gives a grid of lists to edit.
+class Board:
+    __slots__ = ("N", "n", "cells", "counts", "masks", "clues", "conflicts")
+
+    def __init__(self, N):
+        self.N = N
+        self.n = math.isqrt(N)
+        self.cells = array('B' if N < 256 else 'H', [0]) * (N * N)
+        # counts[(unit * N) + k - 1] for the units: N rows, N columns, N blocks
+        self.counts = array('B' if N < 256 else 'H', [0]) * (3 * N * N)
+        self.masks = array('Q', [0]) * (3 * N) if N <= 64 else [0] * (3 * N)
+        self.clues = 0
+        # number of cells whose number is already in one of their units, counted once per unit
+        self.conflicts = 0
+
+    @classmethod
+    def from_cells(cls, N, values):
+        board = cls(N)
+        for cell, number in enumerate(values):
+            if number:
+                board.set(cell // N, cell % N, number)
+        return board
+
+    @classmethod
+    def from_rows(cls, rows):
+        if isinstance(rows, Board):
+            return rows.copy()
+        return cls.from_cells(len(rows), [number for line in rows for number in line])
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.N = self.N
+        board.n = self.n
+        board.cells = array(self.cells.typecode, self.cells)
+        board.counts = array(self.counts.typecode, self.counts)
+        board.masks = self.masks[:]
+        board.clues = self.clues
+        board.conflicts = self.conflicts
+        return board
+
+    # indexes of the row, column and block of cell (i, j) in masks
+    def units(self, i, j):
+        N, n = self.N, self.n
+        return i, N + j, 2 * N + (i // n) * n + j // n
+
+    def get(self, i, j):
+        return self.cells[i * self.N + j]
+
+    # puts number in cell (i, j), 0 to empty it
+    def set(self, i, j, number):
+        N = self.N
+        old = self.cells[i * N + j]
+        if old == number:
+            return
+        units = self.units(i, j)
+        if old:
+            self.clues -= 1
+            for unit in units:
+                index = unit * N + old - 1
+                self.counts[index] -= 1
+                if self.counts[index] == 0:
+                    self.masks[unit] &= ~(1 << (old - 1))
+                else:
+                    self.conflicts -= 1
+        if number:
+            self.clues += 1
+            for unit in units:
+                index = unit * N + number - 1
+                if self.counts[index] == 0:
+                    self.masks[unit] |= 1 << (number - 1)
+                else:
+                    self.conflicts += 1
+                self.counts[index] += 1
+        self.cells[i * N + j] = number
+
+    # bitmask of the numbers that cell (i, j) can take, given its row, column and block
+    def candidates(self, i, j):
+        row, col, block = self.units(i, j)
+        masks = self.masks
+        return ~(masks[row] | masks[col] | masks[block]) & ((1 << self.N) - 1)
+
+    def __len__(self):
+        return self.N
+
+    def __getitem__(self, i):
+        N = self.N
+        if isinstance(i, slice):
+            return [tuple(self.cells[r * N:(r + 1) * N]) for r in range(N)[i]]
+        if i < 0:
+            i += N
+        if not 0 <= i < N:
+            raise IndexError("board row out of range")
+        return tuple(self.cells[i * N:(i + 1) * N])
+
+    def __iter__(self):
+        N = self.N
+        for i in range(N):
+            yield tuple(self.cells[i * N:(i + 1) * N])
+
+    def __eq__(self, other):
+        if isinstance(other, Board):
+            return self.cells == other.cells
+        try:
+            return self.tolist() == other
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def tolist(self):
+        N = self.N
+        return [self.cells[i * N:(i + 1) * N].tolist() for i in range(N)]
+
+    def __repr__(self):
+        return "Board(" + repr(self.tolist()) + ")"
+
+# the numbers of the cells of a sudoku, row by row
+def sudoku_cells(sudoku):
+    if isinstance(sudoku, Board):
+        return sudoku.cells
+    return [number for line in sudoku for number in line]
+
+# reads one line of the pipe format, e.g. "|1| | |4|", N is the number of
+# columns expected (0 for the first line of a sudoku)
+def sudoku_parse_row(line, N=0):
+    line = line.replace(" ", "").strip().split("|")
+    if line[0] != '':
+        raise SudokuFormatError("illegal input: every line should start with |")
+    if line.pop() != '' or len(line) < 2:
+        raise SudokuFormatError("illegal input: every line should end with |")
+    line = line[1:]
+    if N == 0:
+        if not sudoku_valid_size(len(line)):
+            raise SudokuFormatError("illegal input: the size should be n*n with n >= 2")
+    elif N != len(line):
+        raise SudokuFormatError("illegal input: number of columns not invariant")
+    N = len(line)
+    try:
+        return [int(x) if x != '' and int(x) >= 0 and int(x) <= N else 0 for x in line]
+    except ValueError:
+        raise SudokuFormatError("illegal input: cells should contain numbers")
+
+# reads a sudoku written on one line: either one character per cell
+# ("." or "0" for an empty cell, then 1-9 and a-z for 10-35, e.g. 81
+# characters for a 9x9), or numbers separated by commas (empty or 0 for an
+# empty cell)
+def sudoku_parse_line(line):
+    line = line.strip()
+    try:
+        if "," in line:
+            values = [0 if x.strip() in ("", ".") else int(x) for x in line.split(",")]
+        else:
+            values = [0 if x == "." else int(x, 36) for x in line]
+    except ValueError:
+        raise SudokuFormatError("illegal input: unexpected character")
+    N = math.isqrt(len(values))
+    if N * N != len(values) or not sudoku_valid_size(N):
+        raise SudokuFormatError("illegal input: " + str(len(values)) + " cells, the size should be n*n with n >= 2")
+    if any(number < 0 or number > N for number in values):
+        raise SudokuFormatError("illegal input: number out of range")
+    return Board.from_cells(N, values)
+
+# reads the puzzles of a file (name or open file) one at a time, in any mix of
+# the pipe format and the one-line formats; empty lines and lines starting
+# with # are ignored. Yields (line number, Board) for every record, with a
+# SudokuFormatError in place of the sudoku for a bad record. After an error
+# inside a pipe grid, its remaining rows are skipped (up to the next line that
+# is not a row when its size cannot be told), the next grid is read as usual.
+def sudoku_stream(myfile):
+    if isinstance(myfile, str):
+        with open(myfile, 'r') as opened:
+            yield from sudoku_stream(opened)
+        return
+    grid = []
+    start = 0
+    # rows of a bad grid left to skip, -1 for all of them up to a line that is not a row
+    skipping = 0
+    for lineno, line in enumerate(myfile, 1):
+        text = line.strip()
+        if text.startswith("|"):
+            if skipping:
+                if skipping > 0:
+                    skipping -= 1
+                continue
+            if not grid:
+                start = lineno
+            try:
+                grid.append(sudoku_parse_row(text, len(grid[0]) if grid else 0))
+            except SudokuFormatError as e:
+                yield start, SudokuFormatError("line " + str(lineno) + ": " + str(e))
+                N = len(grid[0]) if grid else text.count("|") - 1
+                skipping = N - len(grid) - 1 if sudoku_valid_size(N) else -1
+                grid = []
+                continue
+            if len(grid) == len(grid[0]):
+                yield start, Board.from_rows(grid)
+                grid = []
+            continue
+        skipping = 0
+        if grid:
+            yield start, SudokuFormatError("line " + str(lineno) + ": illegal input: " + str(len(grid))
+                                           + " lines instead of " + str(len(grid[0])))
+            grid = []
+        if text == "" or text.startswith("#"):
+            continue
+        try:
+            yield lineno, sudoku_parse_line(text)
+        except SudokuFormatError as e:
+            yield lineno, SudokuFormatError("line " + str(lineno) + ": " + str(e))
+    if grid:
+        yield start, SudokuFormatError("end of file: illegal input: " + str(len(grid))
+                                       + " lines instead of " + str(len(grid[0])))
 
 # reads a sudoku from file
 # columns are separated by |, lines by newlines
@@ -11,84 +277,355 @@ import subprocess
 # | | |2| |
 # | |2| | |
 # spaces and empty lines are ignored
+# (the one-line formats of sudoku_parse_line are accepted too)
 def sudoku_read(filename):
-    myfile = open(filename, 'r')
-    sudoku = []
-    N = 0
-    for line in myfile:
-        line = line.replace(" ", "")
-        if line == "":
-            continue
-        line = line.split("|")
-        if line[0] != '':
-            exit("illegal input: every line should start with |\n")
-        line = line[1:]
-        if line.pop() != '\n':
-            exit("illegal input\n")
-        if N == 0:
-            N = len(line)
-            if N != 4 and N != 9 and N != 16 and N != 25:
-                exit("illegal input: only size 4, 9, 16 and 25 are supported\n")
-        elif N != len(line):
-            exit("illegal input: number of columns not invariant\n")
-        line = [int(x) if x != '' and int(x) >= 0 and int(x) <= N else 0 for x in line]
-        sudoku += [line]
-    return sudoku
+    for lineno, sudoku in sudoku_stream(filename):
+        if isinstance(sudoku, SudokuFormatError):
+            raise sudoku
+        return sudoku
+    raise SudokuFormatError("illegal input: no sudoku in " + filename)
 
 # print sudoku on stdout
 def sudoku_print(myfile, sudoku):
+    myfile.write(sudoku_render(sudoku))
+
+# output formats of the grids: "pipe" (the format of sudoku_read), "line" (one
+# line, the format of sudoku_format_line) and "json" (JSON array of the rows)
+OUTPUT_FORMATS = ["pipe", "line", "json"]
+# text of the cells in the pipe format, by size
+PIPE_LABELS = {}
+
+# text of a grid in one of OUTPUT_FORMATS, built in one piece so that it is
+# written with one call; it ends with a newline. No solution ([]) is written
+# "impossible sudoku", "impossible" or null
+def sudoku_render(sudoku, form="pipe"):
+    if form == "json":
+        return json.dumps(None if sudoku == [] else list(sudoku)) + "\n"
+    if form == "line":
+        return ("impossible" if sudoku == [] else sudoku_format_line(sudoku)) + "\n"
     if sudoku == []:
-        myfile.write("impossible sudoku\n")
+        return "impossible sudoku\n"
     N = len(sudoku)
-    for line in sudoku:
-        myfile.write("|")
-        for number in line:
-            if N > 9 and number < 10:
-                myfile.write(" ")
-            myfile.write(" " if number == 0 else str(number))
-            myfile.write("|")
-        myfile.write("\n")
-
-# get number of constraints for sudoku
-def sudoku_constraints_number(sudoku):
+    labels = PIPE_LABELS.get(N)
+    if labels is None:
+        width = len(str(N))
+        labels = PIPE_LABELS[N] = [" " * width] + [str(number).rjust(width) for number in range(1, N + 1)]
+    cells = [labels[number] for number in sudoku_cells(sudoku)]
+    return "".join(["|" + "|".join(cells[i * N:(i + 1) * N]) + "|\n" for i in range(N)])
+
+# one JSON Lines record of the fields; the grids are written as arrays of rows
+def sudoku_json(**fields):
+    return json.dumps({name: list(value) if isinstance(value, Board) else value
+                       for name, value in fields.items()}) + "\n"
+
+# writes a sudoku on one line, in the format read by sudoku_parse_line: one
+# character per cell up to size 35, numbers separated by commas above
+def sudoku_format_line(sudoku):
+    if len(sudoku) > 35:
+        return ",".join(map(str, sudoku_cells(sudoku)))
+    digits = ".123456789abcdefghijklmnopqrstuvwxyz"
+    return "".join([digits[number] for number in sudoku_cells(sudoku)])
+
+# get number of constraints for sudoku, before preprocessing: the generic
+# clauses are counted without being built, 4 * N^2 groups of N variables with
+# one "at least one" clause and the "at most one" clauses of the encoding each
+# (N(N-1)/2 when pairwise), the same for every group; plus one unit clause per clue
+def sudoku_constraints_number(sudoku, encoding=None):
     N = len(sudoku)
 
-    count = 4 * (N ** 2) * ( 1 + N * (N - 1) / 2)
+    group = CNF(N)
+    sudoku_at_most_one(group, list(range(1, N + 1)), sudoku_encoding(N, encoding))
+    count = 4 * N * N * (1 + group.nclauses)
 
-    pre_filled_count = sum(1 for line in sudoku for number in line if number > 0)  # Now this should work
+    pre_filled_count = Board.from_rows(sudoku).clues
 
     print(count + pre_filled_count)
     return count + pre_filled_count
 
-# prints the generic constraints for sudoku of size N
-def sudoku_generic_constraints(myfile, N):
-
-    def output(s):
-        myfile.write(s)
-
-    # Notice that the following function only works for N = 4 or N = 9
-    def newlit(i,j,k, N=N):
-        output(str(i * N + j)+str(k).zfill(2)+ " ")
-
-    def newneglit(i,j,k, N=N):
-        output("-"+ str(i * N + j)+str(k).zfill(2)+ " ")
-
-    def newcl():
-        output("0\n")
-
-    def newcomment(s):
-        output("")
+# timing of the phases of a run (--profile): every phase records its start and
+# duration in seconds, the peak of the memory allocated by Python during the
+# phase (traced with tracemalloc, the JVM is not included) and optional fields,
+# e.g. the statistics of the SAT solver. Phases can be nested.
+# With memory=False nothing is traced (the peaks are 0), which does not slow
+# the timed code down, e.g. for sudokub-bench.py.
+class Profile:
+    def __init__(self, memory=True):
+        self.start = time.perf_counter()
+        self.phases = []
+        self.stack = []
+        if memory:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name, **fields):
+        peak = tracemalloc.get_traced_memory()[1]
+        for outer in self.stack:
+            outer["peak_bytes"] = max(outer["peak_bytes"], peak)
+        tracemalloc.reset_peak()
+        record = {"name": name, "depth": len(self.stack), "start_s": time.perf_counter() - self.start}
+        record.update(fields)
+        record["peak_bytes"] = 0
+        self.phases.append(record)
+        self.stack.append(record)
+        begin = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - begin
+            peak = tracemalloc.get_traced_memory()[1]
+            for outer in self.stack:
+                outer["peak_bytes"] = max(outer["peak_bytes"], peak)
+            self.stack.pop()
+
+    # adds fields (e.g. solver statistics) to the last phase of that name
+    def note(self, name, **fields):
+        for record in reversed(self.phases):
+            if record["name"] == name:
+                record.update(fields)
+                return
+
+    # total time, count and peak memory of every phase name
+    def summary(self):
+        summary = {}
+        for record in self.phases:
+            entry = summary.setdefault(record["name"], {"count": 0, "seconds": 0.0, "peak_bytes": 0})
+            entry["count"] += 1
+            entry["seconds"] += record["seconds"]
+            entry["peak_bytes"] = max(entry["peak_bytes"], record["peak_bytes"])
+        return summary
+
+    def write(self, filename, command):
+        with open(filename, 'w') as myfile:
+            json.dump({"command": command, "total_s": time.perf_counter() - self.start,
+                       "summary": self.summary(), "phases": self.phases}, myfile, indent=1)
+
+PROFILE = None
+
+# times a phase of the run when profiling, does nothing otherwise:
+#   with sudoku_phase("encode"): ...
+def sudoku_phase(name, **fields):
+    if PROFILE is None:
+        return contextlib.nullcontext()
+    return PROFILE.phase(name, **fields)
+
+# text of every literal with its separator, indexed by literal + offset; only
+# made for formulas of at most DIMACS_TABLE_LIMIT variables
+DIMACS_TABLE = None
+DIMACS_TABLE_LIMIT = 1 << 18
+
+# DIMACS text of 0-terminated clauses given as an array('i'), one clause per
+# line; with NumPy, the text is made in one pass by joining the texts of the
+# literals looked up in DIMACS_TABLE
+def dimacs_text(literals):
+    global DIMACS_TABLE
+    if numpy is None or len(literals) == 0:
+        return " ".join(map(str, literals)).replace(" 0 ", " 0\n") + "\n"
+    values = numpy.frombuffer(literals, dtype=numpy.intc)
+    largest = int(numpy.abs(values).max())
+    if largest > DIMACS_TABLE_LIMIT:
+        return " ".join(map(str, literals)).replace(" 0 ", " 0\n") + "\n"
+    if DIMACS_TABLE is None or len(DIMACS_TABLE) < 2 * largest + 1:
+        DIMACS_TABLE = numpy.array([str(lit) + " " for lit in range(-largest, largest + 1)], dtype=object)
+        DIMACS_TABLE[largest] = "0\n"
+    return "".join(DIMACS_TABLE[values + len(DIMACS_TABLE) // 2].tolist())
+
+# clause store
+# the literals of all the clauses are kept in one flat array of ints, every
+# clause being terminated by a 0 exactly like in the DIMACS format
+class CNF:
+    def __init__(self, nvars=0):
+        self.nvars = nvars
+        self.nclauses = 0
+        self.literals = array('i')
+        # size of the sudoku encoded by the formula (0 if unknown)
+        self.size = 0
+        # for a reduced formula: original id (i*N + j)*N + k of every variable,
+        # and the sudoku with the cells fixed before encoding
+        self.names = None
+        self.board = None
+        # DIMACS text of the first clauses, and number of literals it covers
+        self.prefix = ("", 0)
+        # for a formula mapped from a binary file: start of every clause in
+        # literals, which is then a read-only memoryview of the file
+        self.offsets = None
+
+    # copy sharing the cached text, e.g. to add clues to a template
+    def copy(self):
+        cnf = CNF(self.nvars)
+        cnf.nclauses = self.nclauses
+        cnf.literals.frombytes(memoryview(self.literals).cast('B'))
+        cnf.size = self.size
+        cnf.names = self.names
+        cnf.board = self.board
+        cnf.prefix = self.prefix
+        return cnf
+
+    def add_clause(self, clause):
+        self.literals.extend(clause)
+        self.literals.append(0)
+        self.nclauses += 1
+
+    # allocates an auxiliary variable
+    def new_var(self):
+        self.nvars += 1
+        return self.nvars
+
+    # adds several clauses given as one flat list of 0-terminated literals
+    def add_flat(self, literals, count):
+        self.literals.extend(literals)
+        self.nclauses += count
+
+    # iterates over the clauses as lists of literals
+    def clauses(self):
+        clause = []
+        for lit in self.literals:
+            if lit == 0:
+                yield clause
+                clause = []
+            else:
+                clause.append(lit)
+
+    # DIMACS text of the clauses in pieces ending at clause boundaries: the cached
+    # prefix first, then the other clauses formatted piece by piece, so that a
+    # solver reading from a pipe starts parsing before the whole text exists
+    def dimacs_chunks(self, size=65536):
+        text, start = self.prefix
+        if text:
+            yield text
+        literals = self.literals
+        end = len(literals)
+        while start < end:
+            stop = min(start + size, end)
+            while literals[stop - 1] != 0:
+                stop += 1
+            yield dimacs_text(literals[start:stop])
+            start = stop
+
+    # DIMACS text of the clauses, only the ones after the cached prefix are formatted
+    def dimacs_body(self):
+        return "".join(self.dimacs_chunks())
+
+    # caches the text of all the current clauses
+    def freeze(self):
+        self.prefix = (self.dimacs_body(), len(self.literals))
+
+    # writes the whole formula in DIMACS format, piece by piece
+    def write_dimacs(self, myfile):
+        myfile.write("p cnf " + str(self.nvars) + " " + str(self.nclauses) + "\n")
+        for chunk in self.dimacs_chunks():
+            myfile.write(chunk)
+
+# variable for "cell (i, j) contains k", numbered from 1 to N^3
+def sudoku_var(i, j, k, N):
+    return (i * N + j) * N + k
+
+# builds a sudoku from the positive literals of a model, variables of a
+# reduced formula are first mapped back to their original id with names
+def sudoku_decode(units, N, names=None, board=None):
+    sudoku = Board(N) if board is None else Board.from_rows(board)
+    for var in units:
+        if names is not None:
+            var = names[var] if 0 < var < len(names) else 0
+        if var <= 0 or var > N ** 3:
+            continue
+        cell, k = divmod(var - 1, N)
+        sudoku.set(cell // N, cell % N, k + 1)
+    return sudoku
 
-    if N == 4:
-        n = 2
-    elif N == 9:
-        n = 3
-    elif N == 16:
-        n = 4
-    elif N == 25:
-        n = 5
-    else:
-        exit("Only supports size 4, 9, 16 and 25")
+# "at most one of the variables of group is true" encodings. Groups of at most
+# 4 variables are always encoded pairwise, bigger groups use auxiliary
+# variables allocated with cnf.new_var()
+
+# pairwise: one binary clause per pair, n(n-1)/2 clauses
+def amo_pairwise(cnf, group):
+    literals = []
+    for a in range(len(group)):
+        for b in range(a + 1, len(group)):
+            literals += (-group[a], -group[b], 0)
+    cnf.add_flat(literals, len(literals) // 3)
+
+# sequential counter (Sinz): s_i is true when one of x_1..x_i is true,
+# 3n-4 clauses and n-1 auxiliary variables
+def amo_sequential(cnf, group):
+    if len(group) <= 4:
+        return amo_pairwise(cnf, group)
+    n = len(group)
+    s = [cnf.new_var() for i in range(n - 1)]
+    literals = [-group[0], s[0], 0]
+    for i in range(1, n - 1):
+        literals += (-group[i], s[i], 0, -s[i - 1], s[i], 0, -group[i], -s[i - 1], 0)
+    literals += (-group[n - 1], -s[n - 2], 0)
+    cnf.add_flat(literals, len(literals) // 3)
+
+# commander (Klieber and Kwon): the group is split in subgroups of 3 with one
+# commander each, true iff one variable of its subgroup is, and at most one
+# commander is true
+def amo_commander(cnf, group):
+    if len(group) <= 4:
+        return amo_pairwise(cnf, group)
+    commanders = []
+    for start in range(0, len(group), 3):
+        subgroup = group[start:start + 3]
+        c = cnf.new_var()
+        commanders.append(c)
+        amo_pairwise(cnf, subgroup)
+        for x in subgroup:
+            cnf.add_clause((-x, c))
+        cnf.add_clause([-c] + subgroup)
+    amo_commander(cnf, commanders)
+
+# product (Chen): the variables are placed in a p x q grid, a true variable
+# selects its row and its column, and at most one row and one column are selected
+def amo_product(cnf, group):
+    if len(group) <= 4:
+        return amo_pairwise(cnf, group)
+    p = math.isqrt(len(group) - 1) + 1
+    q = (len(group) + p - 1) // p
+    rows = [cnf.new_var() for i in range(p)]
+    cols = [cnf.new_var() for j in range(q)]
+    for index, x in enumerate(group):
+        cnf.add_clause((-x, rows[index // q]))
+        cnf.add_clause((-x, cols[index % q]))
+    amo_product(cnf, rows)
+    amo_product(cnf, cols)
+
+AMO_ENCODINGS = {"pairwise": amo_pairwise, "sequential": amo_sequential,
+                 "commander": amo_commander, "product": amo_product}
+
+# encoding used for each size when none is chosen. Measured on the bundled
+# puzzles (generic formula, clues as assumptions, solve + uniqueness check):
+# the auxiliary variables make the formulas 3 to 4 times smaller at N = 16
+# and 25, but propagation through them is slower and pairwise stays the
+# fastest to solve for every size. Above 25, pairwise gives millions of clauses
+# (3.3 millions at N = 36) and product is used: the smallest formula, and as
+# fast to solve as commander and faster than sequential on 36x36 and 49x49 grids.
+DEFAULT_ENCODINGS = {4: "pairwise", 9: "pairwise", 16: "pairwise", 25: "pairwise"}
+
+def sudoku_encoding(N, encoding=None):
+    if encoding is None:
+        return DEFAULT_ENCODINGS.get(N, "product")
+    return encoding
+
+def sudoku_at_most_one(cnf, group, encoding="pairwise"):
+    AMO_ENCODINGS[encoding](cnf, group)
+
+# adds the generic constraints for sudoku of size N to the clause store
+def sudoku_generic_constraints(cnf, N, encoding="pairwise"):
+
+    def var(i, j, k):
+        return sudoku_var(i, j, k, N)
+
+    newcl = cnf.add_clause
+
+    if not sudoku_valid_size(N):
+        exit("Only supports sizes n*n with n >= 2")
+    n = math.isqrt(N)
+
+    cnf.nvars = max(cnf.nvars, N ** 3)
+    cnf.size = N
+
+    if numpy is not None:
+        return sudoku_generic_constraints_numpy(cnf, N, n, encoding)
 
     # First, let's ensure that the solver have to fill in every cell with at least a number, ad that it appears at least one 
     # time per column, row, and block
@@ -96,26 +633,17 @@ def sudoku_generic_constraints(myfile, N):
     # each cell contains a number
     for row in range(N):
         for col in range(N):
-            for nb in range(1, N + 1):
-                # Create the constraint that this number must be in this cell
-                newlit(row, col, nb)
-            newcl()
+            newcl([var(row, col, nb) for nb in range(1, N + 1)])
 
     # each column contains every number once
     for col in range(N):
         for nb in range(1, N + 1):
-            for row in range(N):
-                # Create the constraint that this number must be in this column
-                newlit(row, col, nb)
-            newcl()
-                
+            newcl([var(row, col, nb) for row in range(N)])
+
     # each row contains every number once
     for row in range(N):
         for nb in range(1, N + 1):
-            for col in range(N):
-                # Create the constraint that this number must be in this row
-                newlit(row, col, nb)
-            newcl()
+            newcl([var(row, col, nb) for col in range(N)])
 
     # each block contains every number once
     for block in range(N):
@@ -123,291 +651,1802 @@ def sudoku_generic_constraints(myfile, N):
         block_row = (block // n) * n
         block_col = (block % n) * n
 
-        # Now iterate over each cell within the block
-        for row in range(block_row, block_row + n):
-            for col in range(block_col, block_col + n):
-                for number in range(1, N + 1):
-                    # Create the constraint that this number must be in this block
-                    newlit(row, col, number)
-                newcl()
-
+        for number in range(1, N + 1):
+            newcl([var(row, col, number)
+                   for row in range(block_row, block_row + n)
+                   for col in range(block_col, block_col + n)])
 
     # Now, We need to ensure that every row, col, block has every number at most once
+    def at_most_one(group):
+        sudoku_at_most_one(cnf, group, encoding)
+
     # each cell contains at most one number
     for row in range(N):
         for col in range(N):
-            for nb1 in range(1, N + 1):
-                for nb2 in range(nb1 + 1, N + 1):
-                    newneglit(row, col, nb1)
-                    newneglit(row, col, nb2)
-                    newcl()
+            at_most_one([var(row, col, nb) for nb in range(1, N + 1)])
 
     # for each line, each number appears at most once
     for row in range(N):
         for nb in range(1, N+1):
-            for col1 in range(N):
-                for col2 in range(col1 + 1, N):
-                    newneglit(row, col1, nb)
-                    newneglit(row, col2, nb)
-                    newcl()
+            at_most_one([var(row, col, nb) for col in range(N)])
 
     # for each column, each number appears at most once
     for col in range(N):
         for nb in range(1, N + 1):
-            for row1 in range(N):
-                for row2 in range(row1 + 1, N):
-                    newneglit(row1, col, nb)
-                    newneglit(row2, col, nb)
-                    newcl()
+            at_most_one([var(row, col, nb) for row in range(N)])
 
-# for each block, each number appears at most once
+    # for each block, each number appears at most once
+    # (every pair of cells of the block is only considered once)
     for block in range(N):
-        # Calculate the starting row and column for this block
         block_row = (block // n) * n
         block_col = (block % n) * n
 
-        # Now iterate over each number within the block
         for number in range(1, N + 1):
-            # Iterate over each cell within the block
-            for row1 in range(block_row, block_row + n):
-                for col1 in range(block_col, block_col + n):
-                    # Now iterate over each cell again within the block to create pairs
-                    for row2 in range(block_row, block_row + n):
-                        for col2 in range(block_col, block_col + n):
-                            # Ensure we don't compare a cell with itself
-                            if row1 == row2 and col1 == col2:
-                                continue
-                            # Create the constraint that this number cannot be in both cells
-                            newneglit(row1, col1, number)
-                            newneglit(row2, col2, number)
-                            newcl()
-
-
-def sudoku_specific_constraints(myfile, sudoku):
+            at_most_one([var(row, col, number)
+                         for row in range(block_row, block_row + n)
+                         for col in range(block_col, block_col + n)])
+
+# same clauses and variables in the same order, built with NumPy: every family
+# is a matrix with one group of N variables per line, taken from the N x N x N
+# array of the variables by transposing it. The at-most-one clauses of a group
+# of N variables are built once on variables 1..N (and N+1.. for the auxiliary
+# ones), then the literals of all the groups come from one lookup in a table
+# giving the actual variables of every group
+def sudoku_generic_constraints_numpy(cnf, N, n, encoding="pairwise"):
+    var = numpy.arange(1, N ** 3 + 1, dtype=numpy.int32).reshape(N, N, N)
+    cells = var.reshape(N * N, N)
+    columns = var.transpose(1, 2, 0).reshape(N * N, N)
+    rows = var.transpose(0, 2, 1).reshape(N * N, N)
+    # (block row, row, block column, column, number) -> (block, number, cell of the block)
+    blocks = var.reshape(n, n, n, n, N).transpose(0, 2, 4, 1, 3).reshape(N * N, N)
+
+    at_least_one = numpy.concatenate([cells, columns, rows, blocks])
+    zeros = numpy.zeros((len(at_least_one), 1), dtype=numpy.int32)
+    literals = [numpy.hstack([at_least_one, zeros]).ravel()]
+
+    template = CNF(N)
+    sudoku_at_most_one(template, list(range(1, N + 1)), encoding)
+    aux = template.nvars - N
+    pattern = numpy.frombuffer(template.literals, dtype=numpy.intc).astype(numpy.int32)
+    for groups in [cells, rows, columns, blocks]:
+        table = numpy.zeros((len(groups), 1 + N + aux), dtype=numpy.int32)
+        table[:, 1:N + 1] = groups
+        table[:, N + 1:] = (cnf.nvars + 1 + numpy.arange(len(groups) * aux, dtype=numpy.int32)).reshape(len(groups), aux)
+        cnf.nvars += len(groups) * aux
+        literals.append((table[:, numpy.abs(pattern)] * numpy.sign(pattern)).ravel())
+
+    literals = numpy.concatenate(literals).astype(numpy.intc)
+    cnf.literals.frombytes(literals.tobytes())
+    cnf.nclauses += 4 * N * N * (1 + template.nclauses)
+
+# the generic constraints only depend on N: they are built once per size, kept
+# in memory and saved as a template (binary format, mapped when loaded, + DIMACS text) on disk.
+# ENCODING_VERSION must be increased whenever the generic encoding changes.
+ENCODING_VERSION = 1
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sudoku-templates")
+GENERIC_CACHE = {}
+
+def sudoku_load_template(path):
+    cnf = sudoku_load_binary(path + ".bin")
+    with open(path + ".cnf", 'r') as myfile:
+        cnf.prefix = (myfile.read(), len(cnf.literals))
+    return cnf
+
+def sudoku_save_template(path, cnf):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written under a temporary name first so that concurrent runs never read a partial template
+    tmp = path + "." + str(os.getpid())
+    sudoku_write_binary(tmp + ".bin", cnf)
+    with open(tmp + ".cnf", 'w') as myfile:
+        myfile.write(cnf.prefix[0])
+    os.replace(tmp + ".bin", path + ".bin")
+    os.replace(tmp + ".cnf", path + ".cnf")
+
+# returns the (shared, never modified) template of the generic constraints for size N
+def sudoku_generic_cnf(N, encoding=None):
+    encoding = sudoku_encoding(N, encoding)
+    if (N, encoding) in GENERIC_CACHE:
+        return GENERIC_CACHE[(N, encoding)]
+    path = os.path.join(TEMPLATE_DIR, "generic-" + str(N) + "-" + encoding + "-v" + str(ENCODING_VERSION))
+    try:
+        with sudoku_phase("load template"):
+            cnf = sudoku_load_template(path)
+        cnf.size = N
+    except (OSError, EOFError, ValueError):
+        cnf = CNF()
+        with sudoku_phase("generic constraints"):
+            sudoku_generic_constraints(cnf, N, encoding)
+        with sudoku_phase("format template"):
+            cnf.freeze()
+        try:
+            sudoku_save_template(path, cnf)
+        except OSError:
+            pass
+    GENERIC_CACHE[(N, encoding)] = cnf
+    return cnf
+
+def sudoku_specific_constraints(cnf, sudoku):
+
+    for lit in sudoku_clues(sudoku):
+        cnf.add_clause((lit,))
+
+# blocks the solution sudoku; the cells given in puzzle are left out of the clause,
+# their literals can never be false
+def sudoku_other_solution_constraint(cnf, sudoku, names=None, puzzle=None):
 
     N = len(sudoku)
+    cells = sudoku_cells(sudoku)
 
-    def output(s):
-        myfile.write(s)
-
-    # Fixed
-    def newlit(i,j,k, N=N):
-        output(str(i * N + j)+str(k).zfill(2)+ " ")
-
-    def newcl():
-        output("0\n")
-
-    for i in range(N):
-        for j in range(N):
-            if sudoku[i][j] > 0:
-                newlit(i, j, sudoku[i][j])
-                newcl()
-
-def sudoku_other_solution_constraint(myfile, sudoku):
-
+    # Added a constraint that tells that at least one of the numbers in the first solution must be different in the other.
+    if names is None:
+        given = [0] * (N * N) if puzzle is None else sudoku_cells(puzzle)
+        cnf.add_clause([-(cell * N + number) for cell, number in enumerate(cells) if given[cell] == 0])
+    else:
+        # reduced formula: only the cells left to the solver can differ
+        chosen = set(cell * N + number for cell, number in enumerate(cells))
+        cnf.add_clause([-var for var in range(1, len(names)) if names[var] in chosen])
+
+# binary format of a formula, in native byte order: CNF_MAGIC, then the 32-bit
+# ints version, number of variables, of clauses and of literals, then the
+# offsets of the clauses (number of clauses + 1 ints) and the literals, every
+# clause terminated by a 0 as in CNF.literals
+CNF_MAGIC = b"SCNF"
+CNF_BINARY_VERSION = 1
+
+def sudoku_write_binary(filename, cnf):
+    offsets = array('i', [0])
+    offsets.extend(index + 1 for index, lit in enumerate(cnf.literals) if lit == 0)
+    with open(filename, 'wb') as myfile:
+        myfile.write(CNF_MAGIC)
+        array('i', [CNF_BINARY_VERSION, cnf.nvars, cnf.nclauses, len(cnf.literals)]).tofile(myfile)
+        offsets.tofile(myfile)
+        myfile.write(cnf.literals)
+
+# maps a formula written by sudoku_write_binary: nothing is copied, the literals
+# of the returned formula are read from the file as they are used (copy() it
+# before adding clauses)
+def sudoku_load_binary(filename):
+    with open(filename, 'rb') as myfile:
+        data = memoryview(mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ))
+    header = len(CNF_MAGIC) + 4 * 4
+    if len(data) < header or data[:len(CNF_MAGIC)] != CNF_MAGIC:
+        raise ValueError(filename + ": not a binary CNF file")
+    version, nvars, nclauses, nliterals = data[len(CNF_MAGIC):header].cast('i')
+    if version != CNF_BINARY_VERSION or len(data) != header + 4 * (nclauses + 1 + nliterals):
+        raise ValueError(filename + ": unsupported or truncated binary CNF file")
+    cnf = CNF(nvars)
+    cnf.nclauses = nclauses
+    cnf.offsets = data[header:header + 4 * (nclauses + 1)].cast('i')
+    cnf.literals = data[header + 4 * (nclauses + 1):].cast('i')
+    return cnf
+
+# opens a DIMACS file, compressed with gzip or xz when its name ends with .gz or .xz
+def sudoku_open_dimacs(filename, mode='r'):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + 't')
+    if filename.endswith(".xz"):
+        return lzma.open(filename, mode + 't')
+    return open(filename, mode)
+
+# reads a formula written by sudoku_write_cnf, in any of its formats
+def sudoku_read_cnf(filename):
+    if filename.endswith(".bin"):
+        return sudoku_load_binary(filename)
+    cnf = CNF()
+    with sudoku_open_dimacs(filename) as myfile:
+        for line in myfile:
+            if line.startswith("p"):
+                cnf.nvars = int(line.split()[2])
+            elif not line.startswith("c"):
+                cnf.literals.extend(int(lit) for lit in line.split())
+    cnf.nclauses = cnf.literals.count(0)
+    return cnf
+
+# builds the formula for a sudoku and writes it in DIMACS format, compressed
+# for a name ending with .gz or .xz, or in the binary format for .bin
+def sudoku_write_cnf(filename, sudoku, cnf=None, encoding=None):
+    if cnf is None:
+        cnf = sudoku_generic_cnf(len(sudoku), encoding).copy()
+        sudoku_specific_constraints(cnf, sudoku)
+    if filename.endswith(".bin"):
+        sudoku_write_binary(filename, cnf)
+    else:
+        with sudoku_open_dimacs(filename, 'w') as myfile:
+            cnf.write_dimacs(myfile)
+    return cnf
+
+# cells (numbered i*N + j) of every row, column and block, and the peers of
+# every cell, i.e. the other cells sharing a unit with it
+UNITS_CACHE = {}
+
+def sudoku_units(N):
+    if N not in UNITS_CACHE:
+        n = math.isqrt(N)
+        units = [[i * N + j for j in range(N)] for i in range(N)]
+        units += [[i * N + j for i in range(N)] for j in range(N)]
+        units += [[(row + i) * N + col + j for i in range(n) for j in range(n)]
+                  for row in range(0, N, n) for col in range(0, N, n)]
+        peers = [set() for cell in range(N * N)]
+        for unit in units:
+            for cell in unit:
+                peers[cell].update(unit)
+        for cell in range(N * N):
+            peers[cell].discard(cell)
+        UNITS_CACHE[N] = (units, [sorted(p) for p in peers])
+    return UNITS_CACHE[N]
+
+# constraint propagation before encoding: naked singles (a cell with only one
+# candidate left) and hidden singles (a number with only one possible cell in
+# a unit) are filled in until nothing changes.
+# The candidates of every cell are kept as a bitmask (bit k-1 for number k).
+# Returns the completed sudoku and the candidates, or None when a contradiction
+# is found (the sudoku has no solution).
+# A Board already knows the candidates left by its clues: only its naked
+# singles are queued instead of all its clues.
+def sudoku_preprocess(sudoku):
     N = len(sudoku)
+    units, peers = sudoku_units(N)
+    if isinstance(sudoku, Board):
+        if sudoku.conflicts > 0:
+            return None
+        board = sudoku.cells.tolist()
+        candidates = [1 << (number - 1) if number else sudoku.candidates(cell // N, cell % N)
+                      for cell, number in enumerate(board)]
+        if 0 in candidates:
+            return None
+        todo = [(cell, left.bit_length()) for cell, left in enumerate(candidates)
+                if board[cell] == 0 and left & (left - 1) == 0]
+    else:
+        board = [number for line in sudoku for number in line]
+        candidates = [(1 << N) - 1] * (N * N)
+        todo = [(cell, board[cell]) for cell in range(N * N) if board[cell] > 0]
+        for cell, number in todo:
+            board[cell] = 0
 
-    def output(s):
-        myfile.write(s)
-
-    def newneglit(i,j,k, N=N):
-        output("-" + str(i * N + j)+str(k).zfill(2)+ " ")
-
-    def newcl():
-        output("0\n")
-
-    # Added a constraint that tells that at least one of the numbers in the first solution must be different in the other.
-    for row in range(N):
-        for col in range(N):
-                nb = sudoku[row][col]
-                newneglit(row, col, nb)
-    newcl()
-                
-def sudoku_solve(filename):
-    command = "java -jar org.sat4j.core.jar sudoku.cnf"
-    process = subprocess.Popen(command, shell=True,
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = process.communicate()
-    for line in out.split(b'\n'):
-        line = line.decode("utf-8")
+    while True:
+        while todo:
+            cell, number = todo.pop()
+            bit = 1 << (number - 1)
+            if board[cell] == number:
+                continue
+            if board[cell] != 0 or not candidates[cell] & bit:
+                return None
+            board[cell] = number
+            candidates[cell] = bit
+            for peer in peers[cell]:
+                if candidates[peer] & bit:
+                    candidates[peer] &= ~bit
+                    left = candidates[peer]
+                    if left == 0:
+                        return None
+                    # naked single
+                    if left & (left - 1) == 0 and board[peer] == 0:
+                        todo.append((peer, left.bit_length()))
+
+        # hidden singles
+        for unit in units:
+            for number in range(1, N + 1):
+                bit = 1 << (number - 1)
+                places = [cell for cell in unit if candidates[cell] & bit]
+                if len(places) == 0:
+                    return None
+                if len(places) == 1 and board[places[0]] == 0:
+                    todo.append((places[0], number))
+        if not todo:
+            break
+
+    return [board[i * N:(i + 1) * N] for i in range(N)], candidates
+
+# formula over the candidates left by sudoku_preprocess only: the filled cells
+# and the eliminated candidates have no variable, the remaining variables are
+# numbered from 1 and cnf.names maps them back to (i*N + j)*N + k
+def sudoku_reduced_cnf(board, candidates, encoding=None):
+    N = len(board)
+    encoding = sudoku_encoding(N, encoding)
+    units, peers = sudoku_units(N)
+    cnf = CNF()
+    cnf.size = N
+    cnf.board = board
+    names = array('i', [0])
+    ids = {}
+    for cell in range(N * N):
+        if board[cell // N][cell % N] == 0:
+            for k in range(1, N + 1):
+                if candidates[cell] & (1 << (k - 1)):
+                    ids[cell * N + k] = len(names)
+                    names.append(cell * N + k)
+    cnf.names = names
+    cnf.nvars = len(names) - 1
+
+    # each free cell contains exactly one of its candidates
+    for cell in range(N * N):
+        group = [ids[cell * N + k] for k in range(1, N + 1) if cell * N + k in ids]
+        if group:
+            cnf.add_clause(group)
+            sudoku_at_most_one(cnf, group, encoding)
+
+    # each number missing in a unit appears exactly once among its free cells
+    for unit in units:
+        for k in range(1, N + 1):
+            group = [ids[cell * N + k] for cell in unit if cell * N + k in ids]
+            if group:
+                cnf.add_clause(group)
+                sudoku_at_most_one(cnf, group, encoding)
+    return cnf
+
+# SAT4J is kept running in a worker process (SatServer.java, next to the jar)
+# so that the JVM startup is only paid once for all the solves of a run
+SAT4J_DIR = os.path.dirname(os.path.abspath(__file__))
+SAT4J_JAR = os.path.join(SAT4J_DIR, "org.sat4j.core.jar")
+
+# limits of every solve, set by --timeout and --memory: a solve still running
+# after SOLVE_TIMEOUT seconds is stopped, a solver process never gets more than
+# SOLVE_MEMORY megabytes; both give a SudokuUnknown instead of a solution.
+# The SAT4J worker stops its search itself at the deadline and is killed when it
+# still has not answered WATCHDOG_GRACE seconds later
+SOLVE_TIMEOUT = None
+SOLVE_MEMORY = None
+WATCHDOG_GRACE = 1.0
+
+# command line and Popen preexec_fn of a solver process under the memory cap: the
+# JVM gets it as its maximum heap (it does not start under an address space
+# limit), the other solvers as the limit of their address space
+def sudoku_limited(command):
+    if SOLVE_MEMORY is None:
+        return command, None
+    if command[0] == "java":
+        return [command[0], "-Xmx" + str(SOLVE_MEMORY) + "m"] + command[1:], None
+    limit = SOLVE_MEMORY << 20
+    return command, lambda: resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+# calls kill after seconds (default SOLVE_TIMEOUT) unless the returned timer is
+# cancelled first; None without a deadline
+def sudoku_watchdog(kill, seconds=None):
+    seconds = SOLVE_TIMEOUT if seconds is None else seconds
+    if seconds is None:
+        return None
+    watchdog = threading.Timer(seconds, kill)
+    watchdog.daemon = True
+    watchdog.start()
+    return watchdog
+
+# kills a solver process started in a session of its own, with the children
+# it may have (e.g. when java is a wrapper script)
+def sudoku_kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+class SolverWorker:
+    def __init__(self, directory=SAT4J_DIR):
+        self.directory = directory
+        self.process = None
+        # deadline of the searches set in the worker, and whether the watchdog
+        # killed it for not answering in time
+        self.timeout = None
+        self.expired = False
+        # (request, formula) of the load/add requests of the incremental
+        # session, replayed after a restart, and the number of loads so far:
+        # the worker holds one session, each load replaces it
+        self.session = []
+        self.loads = 0
+
+    # compiles the shim if needed and launches the JVM; javac writes into a
+    # directory of its own, whose classes are then renamed into place, so that
+    # workers starting together never load a class file another one is writing
+    def start(self):
+        source = os.path.join(self.directory, "SatServer.java")
+        compiled = os.path.join(self.directory, "SatServer.class")
+        if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(source):
+            with sudoku_phase("javac"), tempfile.TemporaryDirectory(prefix=".javac-", dir=self.directory) as output:
+                subprocess.run(["javac", "-cp", SAT4J_JAR, "-d", output, source], check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                for name in os.listdir(output):
+                    os.replace(os.path.join(output, name), os.path.join(self.directory, name))
+        with sudoku_phase("jvm start"):
+            command, _ = sudoku_limited(["java", "-cp", SAT4J_JAR + os.pathsep + self.directory, "SatServer"])
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, text=True, bufsize=1)
+            self.timeout = None
+            self.expired = False
+            alive = self.ping()
+        if not alive:
+            self.stop()
+            raise OSError("SAT4J worker does not answer")
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.write("quit\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self.process.kill()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+        self.deadline()
+        for request, formula in self.session:
+            self.send(request, formula)
+
+    # lines of the answer to the current request, as they arrive
+    def answer(self):
+        for line in self.process.stdout:
+            line = line.rstrip("\n")
+            if line == "end":
+                return
+            yield line
+        raise OSError("SAT4J worker died")
+
+    # passes SOLVE_TIMEOUT on to the worker when it changed
+    def deadline(self):
+        if self.timeout != SOLVE_TIMEOUT:
+            # 0 is no deadline for SatServer: a timeout below 1 ms is 1 ms
+            self.send("timeout " + ("0" if SOLVE_TIMEOUT is None else str(max(int(1000 * SOLVE_TIMEOUT), 1))))
+            self.timeout = SOLVE_TIMEOUT
+
+    # called by the watchdog of a search that does not answer in time
+    def expire(self):
+        self.expired = True
+        self.process.kill()
+
+    # sends one request, followed by the DIMACS text of formula if given,
+    # and returns parse of the lines of its answer (by default, the lines)
+    # (timed as "send", then "search" up to the first line of the answer, then "parse")
+    def send(self, request, formula=None, parse=list):
+        watchdog = None
+        if request.split(" ")[0] in ["solve", "assume"] and SOLVE_TIMEOUT is not None:
+            watchdog = sudoku_watchdog(self.expire, SOLVE_TIMEOUT + WATCHDOG_GRACE)
+        try:
+            with sudoku_phase("send", request=request.split(" ")[0]):
+                self.process.stdin.write(request + "\n")
+                if formula is not None:
+                    formula.write_dimacs(self.process.stdin)
+                self.process.stdin.flush()
+            lines = self.answer()
+            with sudoku_phase("search"):
+                first = next(lines, None)
+            with sudoku_phase("parse"):
+                try:
+                    result = parse(itertools.chain([] if first is None else [first], lines))
+                finally:
+                    # parse may stop early or raise (e.g. SudokuUnknown on "s UNKNOWN"):
+                    # the rest of the answer is skipped so that the next request reads its own
+                    for line in lines:
+                        pass
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        return result
+
+    # health check: the worker is alive and answers
+    def ping(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            return self.send("ping") == ["pong"]
+        except (OSError, ValueError):
+            return False
+
+    # sends a request, restarting the worker once if it is not healthy; a worker
+    # killed by the watchdog is only restarted by the next request
+    def request(self, request, formula=None, parse=list):
+        if self.process is None or self.process.poll() is not None:
+            self.restart()
+        try:
+            self.deadline()
+            answer = self.send(request, formula, parse)
+        except (OSError, ValueError):
+            if self.expired:
+                self.stop()
+                raise SudokuUnknown("no answer from SAT4J within " + str(SOLVE_TIMEOUT) + "s")
+            self.restart()
+            try:
+                answer = self.send(request, formula, parse)
+            except (OSError, ValueError):
+                self.stop()
+                raise SudokuUnknown("SAT4J worker died")
+        if request == "load" or request.startswith("load "):
+            self.session = [(request, formula)]
+            self.loads += 1
+        elif request.startswith("add "):
+            self.session.append((request, formula))
+        return answer
+
+SOLVER_WORKER = None
+
+# returns the shared worker, or None if it cannot be started (e.g. no javac)
+def sudoku_worker():
+    global SOLVER_WORKER
+    if SOLVER_WORKER is None:
+        worker = SolverWorker()
+        try:
+            worker.start()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        atexit.register(worker.stop)
+        SOLVER_WORKER = worker
+    return SOLVER_WORKER
+
+# reads the answer of the SAT solver, line by line: the model may come on
+# several v lines, the last one ends with 0; the model is decoded for the formula
+# cnf when its size is known, otherwise the size is guessed from the number of true
+# variables. Raises SudokuUnknown when the solver gives no definitive answer
+def sudoku_parse_output(lines, cnf=None):
+    units = []
+    reason = "no answer from the SAT solver"
+    for line in lines:
         if line == "" or line[0] == 'c':
+            if ":" not in line and line[2:] != "":
+                reason = line[2:]
+            # statistics of the solver, "c <name> : <value>"
+            if PROFILE is not None and ":" in line:
+                name, _, value = line[1:].partition(":")
+                value = value.strip()
+                try:
+                    PROFILE.note("search", **{name.strip(): int(value) if value.isdigit() else float(value)})
+                except ValueError:
+                    pass
             continue
         if line[0] == 's':
-            if line != 's SATISFIABLE':
+            if line == 's UNSATISFIABLE':
                 return []
+            if line != 's SATISFIABLE':
+                raise SudokuUnknown("SAT solver answered " + line[2:] + " (" + reason + ")")
             continue
         if line[0] == 'v':
-            line = line[2:]
-            units = line.split()
-            if units.pop() != '0':
-                exit("strange output from SAT solver:" + line + "\n")
-            units = [int(x) for x in units if int(x) >= 0]
-            N = len(units)
-            if N == 16:
-                N = 4
-            elif N == 81:
-                N = 9
-            elif N == 256:
-                N = 16
-            elif N == 625:
-                N = 25
-            else:
+            values = line[2:].split()
+            units += [int(x) for x in values if int(x) > 0]
+            if values == [] or values[-1] != '0':
+                continue
+            if cnf is not None and cnf.size > 0:
+                return sudoku_decode(units, cnf.size, cnf.names, cnf.board)
+            N = math.isqrt(len(units))
+            if N * N != len(units) or not sudoku_valid_size(N):
                 exit("strange output from SAT solver:" + line + "\n")
-            sudoku = [ [0 for i in range(N)] for j in range(N)]
-            # Notice that the following function works
-            for number in units:
-                last_two = number % 100
-                first_digits = number // 100
-
-                i = first_digits // N
-                j = first_digits % N
-
-                sudoku[i][j] = last_two
-            
+            sudoku = sudoku_decode(units, N)
             return sudoku
         exit("strange output from SAT solver:" + line + "\n")
-        return []
-    
-import random
-def sudoku_generate(size):
-
-    if size in [4, 9]:
-        health = size*size
-    elif size == 16:
-        health = size * 4
-    else :
-        health = 5
-
-    sudoku = [[ 0 for _ in range(size)] for _ in range(size)]
-
-    # First, we need to generate a random solution
-
-    sudoku[random.randint(0, size - 1)][random.randint(0, size - 1)] = random.randint(1, size)
-    sudoku_print(sys.stdout, sudoku)
-
-    with open("sudoku.cnf", 'w') as myfile:
-        myfile.write("p cnf " + str(size**2) + str(size).zfill(2)  +" "+
-                     str(sudoku_constraints_number(sudoku))+"\n")
-        sudoku_generic_constraints(myfile, size)
-        sudoku_specific_constraints(myfile, sudoku)
-    
-    sudoku = sudoku_solve("sudoku.cnf")
-
-    sudoku_print(sys.stdout, sudoku)
-
-    print("Solution found, starting to remove numbers...")
-    # Now, we need to remove numbers from the solution until it is not unique anymore
-    while True:
-        # Pick a random number
-        row = random.randint(0, size - 1)
-        col = random.randint(0, size - 1)
-
-        nb = sudoku[row][col]
-
-
-        # If it is already 0, then we can't remove it
-        if nb == 0:
-            continue
-
-        # Remove the number
-        sudoku[row][col] = 0
-
-        with open("sudoku.cnf", 'w') as myfile:
-            myfile.write("p cnf " + str(size**2) + str(size).zfill(2)  +" "+
-                        str(sudoku_constraints_number(sudoku))+"\n")
-            sudoku_generic_constraints(myfile, size)
-            sudoku_specific_constraints(myfile, sudoku)
-
-        temp = sudoku_solve("sudoku.cnf")
-
-        with open("sudoku.cnf", 'a') as myfile:
-            sudoku_other_solution_constraint(myfile, temp)
-
-        solvable = sudoku_solve(sudoku)
-
-        print("Health: " + str(health))
-        if solvable == []:
-            continue
+    raise SudokuUnknown(reason)
+
+# incremental solving session in the SAT4J worker: the formula is loaded once,
+# clauses can be added and every solve takes the clues as assumptions, so that
+# the learned clauses are kept from one query to the next. The worker holds a
+# single session: when another one has been loaded since, the formula and the
+# added clauses are loaded again before the next request
+class WorkerSession:
+    def __init__(self, worker, cnf):
+        self.worker = worker
+        self.cnf = cnf
+        self.added = []
+        self.load()
+
+    def load(self):
+        self.worker.request("load", self.cnf)
+        self.loaded = self.worker.loads
+        for clause in self.added:
+            self.worker.request("add " + " ".join(map(str, clause)) + " 0")
+
+    def add_clause(self, clause):
+        if self.worker.loads != self.loaded:
+            self.load()
+        self.added.append(clause)
+        self.worker.request("add " + " ".join(map(str, clause)) + " 0")
+
+    def solve(self, assumptions=()):
+        if self.worker.loads != self.loaded:
+            self.load()
+        return self.worker.request("assume " + " ".join(map(str, assumptions)) + " 0", None,
+                                   lambda lines: sudoku_parse_output(lines, self.cnf))
+
+# same interface when there is no worker: every solve sends the whole formula
+class ColdSession:
+    def __init__(self, cnf):
+        self.cnf = cnf.copy()
+
+    def add_clause(self, clause):
+        self.cnf.add_clause(clause)
+
+    def solve(self, assumptions=()):
+        cnf = self.cnf.copy()
+        for lit in assumptions:
+            cnf.add_clause((lit,))
+        return sudoku_solve(cnf)
+
+# conflict-driven clause learning SAT solver in pure Python, used as the
+# "cdcl" backend when no JVM is wanted. Two watched literals, VSIDS branching
+# with phase saving, first-UIP learning and Luby restarts.
+# Literals are coded as 2*var for var and 2*var+1 for -var.
+class CDCLSolver:
+    def __init__(self, nvars=0):
+        self.nvars = 0
+        self.clauses = []
+        self.learnts = []
+        self.watches = [[], []]
+        # per literal: 1 true, -1 false, 0 unassigned
+        self.value = [0, 0]
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.phase = [False]
+        self.seen = [False]
+        self.heap = []
+        self.var_inc = 1.0
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.ok = True
+        self.max_learnts = 0
+        self.conflicts = 0
+        self.decisions = 0
+        self.propagations = 0
+        # a threading.Event set from another thread to stop the search
+        self.stop = None
+        self.new_vars(nvars)
+
+    def new_vars(self, nvars):
+        for var in range(self.nvars + 1, nvars + 1):
+            self.watches += [[], []]
+            self.value += [0, 0]
+            self.level.append(0)
+            self.reason.append(None)
+            self.activity.append(0.0)
+            self.phase.append(False)
+            self.seen.append(False)
+            self.heap.append((0.0, var))
+        self.nvars = max(self.nvars, nvars)
+
+    def assign(self, lit, reason):
+        self.value[lit] = 1
+        self.value[lit ^ 1] = -1
+        var = lit >> 1
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(lit)
+
+    # adds a clause given with DIMACS literals; only valid at decision level 0
+    def add_clause(self, clause):
+        if not self.ok:
+            return False
+        self.cancel_until(0)
+        value = self.value
+        lits = []
+        for l in clause:
+            if abs(l) > self.nvars:
+                self.new_vars(abs(l))
+            lit = 2 * l if l > 0 else -2 * l + 1
+            if value[lit] == 1 or lit ^ 1 in lits:
+                return True
+            if value[lit] == 0 and lit not in lits:
+                lits.append(lit)
+        if len(lits) == 0:
+            self.ok = False
+        elif len(lits) == 1:
+            self.assign(lits[0], None)
+            self.ok = self.propagate() is None
         else:
-            sudoku[row][col] = nb
-            health -= 1
-
-            if health == 0:
+            self.clauses.append(lits)
+            self.watches[lits[0]].append(lits)
+            self.watches[lits[1]].append(lits)
+        return self.ok
+
+    # bulk loading of a flat list of 0-terminated DIMACS literals, the clauses
+    # are trusted not to repeat a literal
+    def add_flat(self, literals):
+        codes = [2 * l if l > 0 else -2 * l + 1 for l in literals]
+        if codes and max(codes) >> 1 > self.nvars:
+            self.new_vars(max(codes) >> 1)
+        watches = self.watches
+        start = 0
+        for end in (k for k, code in enumerate(codes) if code == 1):
+            if end - start < 2 or self.trail:
+                self.add_clause(literals[start:end])
+            else:
+                lits = codes[start:end]
+                self.clauses.append(lits)
+                watches[lits[0]].append(lits)
+                watches[lits[1]].append(lits)
+            start = end + 1
+        return self.ok
+
+    # unit propagation, returns a conflicting clause or None
+    def propagate(self):
+        value = self.value
+        watches = self.watches
+        trail = self.trail
+        level = len(self.trail_lim)
+        levels = self.level
+        reasons = self.reason
+        while self.qhead < len(trail):
+            false_lit = trail[self.qhead] ^ 1
+            self.qhead += 1
+            self.propagations += 1
+            ws = watches[false_lit]
+            kept = []
+            for n, c in enumerate(ws):
+                if c[0] == false_lit:
+                    c[0] = c[1]
+                    c[1] = false_lit
+                first = c[0]
+                if value[first] == 1:
+                    kept.append(c)
+                    continue
+                for k in range(2, len(c)):
+                    lit = c[k]
+                    if value[lit] != -1:
+                        c[1] = lit
+                        c[k] = false_lit
+                        watches[lit].append(c)
+                        break
+                else:
+                    kept.append(c)
+                    if value[first] == -1:
+                        kept.extend(ws[n + 1:])
+                        watches[false_lit] = kept
+                        self.qhead = len(trail)
+                        return c
+                    value[first] = 1
+                    value[first ^ 1] = -1
+                    levels[first >> 1] = level
+                    reasons[first >> 1] = c
+                    trail.append(first)
+            watches[false_lit] = kept
+        return None
+
+    def cancel_until(self, level):
+        if len(self.trail_lim) <= level:
+            return
+        value = self.value
+        heap = self.heap
+        activity = self.activity
+        start = self.trail_lim[level]
+        for lit in self.trail[start:]:
+            var = lit >> 1
+            self.phase[var] = lit & 1 == 0
+            value[lit] = 0
+            value[lit ^ 1] = 0
+            self.reason[var] = None
+            heapq.heappush(heap, (-activity[var], var))
+        del self.trail[start:]
+        del self.trail_lim[level:]
+        self.qhead = len(self.trail)
+        if len(heap) > 4 * self.nvars + 1000:
+            self.heap = [(-activity[v], v) for v in range(1, self.nvars + 1) if value[2 * v] == 0]
+            heapq.heapify(self.heap)
+
+    def bump(self, var):
+        self.activity[var] += self.var_inc
+        if self.activity[var] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.var_inc *= 1e-100
+            self.heap = [(-self.activity[v], v) for v in range(1, self.nvars + 1) if self.value[2 * v] == 0]
+            heapq.heapify(self.heap)
+
+    # first-UIP conflict analysis, returns the learnt clause and the backjump level
+    def analyze(self, confl):
+        seen = self.seen
+        levels = self.level
+        trail = self.trail
+        current = len(self.trail_lim)
+        learnt = [0]
+        counter = 0
+        lit = None
+        index = len(trail) - 1
+        while True:
+            for q in (confl if lit is None else confl[1:]):
+                var = q >> 1
+                if not seen[var] and levels[var] > 0:
+                    seen[var] = True
+                    self.bump(var)
+                    if levels[var] >= current:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            while not seen[trail[index] >> 1]:
+                index -= 1
+            lit = trail[index]
+            index -= 1
+            confl = self.reason[lit >> 1]
+            seen[lit >> 1] = False
+            counter -= 1
+            if counter == 0:
                 break
-        
-    return sudoku 
-    
-
-def sudoku_generate_cm(size):
-
-    if size in [4, 9]:
-        health = size*size
-    elif size == 16:
-        health = size * 4
-    else :
-        health = 5
-
-    sudoku = [[ 0 for _ in range(size)] for _ in range(size)]
-
-    # First, we need to generate a random solution
-
-    sudoku[random.randint(0, size - 1)][random.randint(0, size - 1)] = random.randint(1, size)
-    sudoku_print(sys.stdout, sudoku)
-
-    with open("sudoku.cnf", 'w') as myfile:
-        myfile.write("p cnf " + str(size**2) + str(size).zfill(2)  +" "+
-                     str(sudoku_constraints_number(sudoku))+"\n")
-        sudoku_generic_constraints(myfile, size)
-        sudoku_specific_constraints(myfile, sudoku)
-    
-    sudoku = sudoku_solve("sudoku.cnf")
-
-    # Remove ever number == size
-    for row in range(size):
-        for col in range(size):
-            if sudoku[row][col] == size:
-                sudoku[row][col] = 0
-
-    sudoku_print(sys.stdout, sudoku)
-
-    print("Solution found, starting to remove numbers...")
-    # Now, we need to remove numbers from the solution until it is not unique anymore
-    while True:
-        # Pick a random number
-        row = random.randint(0, size - 1)
-        col = random.randint(0, size - 1)
-
-        nb = sudoku[row][col]
-
-        # If it is already 0, then we can't remove it
-        if nb == 0:
+        learnt[0] = lit ^ 1
+
+        # drops the literals implied by the other ones of the clause
+        minimized = [learnt[0]]
+        for q in learnt[1:]:
+            reason = self.reason[q >> 1]
+            if reason is None or any(not seen[r >> 1] and levels[r >> 1] > 0 for r in reason[1:]):
+                minimized.append(q)
+        for q in learnt:
+            seen[q >> 1] = False
+
+        backjump = 0
+        if len(minimized) > 1:
+            best = 1
+            for k in range(2, len(minimized)):
+                if levels[minimized[k] >> 1] > levels[minimized[best] >> 1]:
+                    best = k
+            minimized[1], minimized[best] = minimized[best], minimized[1]
+            backjump = levels[minimized[1] >> 1]
+        return minimized, backjump
+
+    def pick_branch(self):
+        heap = self.heap
+        value = self.value
+        while heap:
+            var = heapq.heappop(heap)[1]
+            if value[2 * var] == 0:
+                return 2 * var if self.phase[var] else 2 * var + 1
+        return None
+
+    # keeps the shortest half of the learnt clauses (at level 0 only)
+    def reduce_learnts(self):
+        self.learnts.sort(key=len)
+        removed = set(id(c) for c in self.learnts[len(self.learnts) // 2:] if len(c) > 2)
+        self.learnts = [c for c in self.learnts if id(c) not in removed]
+        for lit in range(len(self.watches)):
+            self.watches[lit] = [c for c in self.watches[lit] if id(c) not in removed]
+
+    # solves the formula under the assumptions (DIMACS literals), returns the
+    # list of true variables or None if unsatisfiable; raises SudokuUnknown when
+    # the time.monotonic() deadline is passed or the stop event is set
+    def solve(self, assumptions=(), deadline=None):
+        if not self.ok:
+            return None
+        self.cancel_until(0)
+        assumptions = [2 * l if l > 0 else -2 * l + 1 for l in assumptions]
+        for l in assumptions:
+            if l >> 1 > self.nvars:
+                self.new_vars(l >> 1)
+        if self.max_learnts == 0:
+            self.max_learnts = max(len(self.clauses) // 3, 1000)
+        restart = 0
+        budget = 100 * luby(restart)
+        steps = 0
+        while True:
+            # the clock and the stop event are only read every 256 steps
+            steps += 1
+            if steps & 255 == 0:
+                if self.stop is not None and self.stop.is_set():
+                    self.cancel_until(0)
+                    raise SudokuUnknown("the CDCL solver was stopped")
+                if deadline is not None and time.monotonic() > deadline:
+                    self.cancel_until(0)
+                    raise SudokuUnknown("no answer from the CDCL solver before the deadline")
+            confl = self.propagate()
+            if confl is not None:
+                self.conflicts += 1
+                budget -= 1
+                if len(self.trail_lim) == 0:
+                    self.ok = False
+                    return None
+                learnt, backjump = self.analyze(confl)
+                self.cancel_until(backjump)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    self.learnts.append(learnt)
+                    self.watches[learnt[0]].append(learnt)
+                    self.watches[learnt[1]].append(learnt)
+                    self.assign(learnt[0], learnt)
+                self.var_inc /= 0.95
+                continue
+            if budget <= 0:
+                self.cancel_until(0)
+                restart += 1
+                budget = 100 * luby(restart)
+                if len(self.learnts) > self.max_learnts:
+                    self.reduce_learnts()
+                    self.max_learnts = int(self.max_learnts * 1.1)
+                continue
+            lit = None
+            while len(self.trail_lim) < len(assumptions):
+                p = assumptions[len(self.trail_lim)]
+                if self.value[p] == 1:
+                    self.trail_lim.append(len(self.trail))
+                elif self.value[p] == -1:
+                    self.cancel_until(0)
+                    return None
+                else:
+                    lit = p
+                    break
+            if lit is None:
+                lit = self.pick_branch()
+                if lit is None:
+                    model = [v for v in range(1, self.nvars + 1) if self.value[2 * v] == 1]
+                    self.cancel_until(0)
+                    return model
+                self.decisions += 1
+            self.trail_lim.append(len(self.trail))
+            self.assign(lit, None)
+
+# Luby sequence 1 1 2 1 1 2 4 1 1 2 ... used for the restart intervals
+def luby(x):
+    size, seq = 1, 0
+    while size < x + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != x:
+        size = (size - 1) >> 1
+        seq -= 1
+        x = x % size
+    return 2 ** seq
+
+class CDCLSession:
+    def __init__(self, cnf, stop=None):
+        self.cnf = cnf
+        with sudoku_phase("send"):
+            self.solver = CDCLSolver(cnf.nvars)
+            self.solver.stop = stop
+            self.solver.add_flat(cnf.literals)
+
+    def add_clause(self, clause):
+        self.solver.add_clause(clause)
+
+    def solve(self, assumptions=()):
+        with sudoku_phase("search"):
+            model = self.solver.solve(assumptions, None if SOLVE_TIMEOUT is None else time.monotonic() + SOLVE_TIMEOUT)
+            if PROFILE is not None:
+                PROFILE.note("search", conflicts=self.solver.conflicts, decisions=self.solver.decisions,
+                             propagations=self.solver.propagations)
+        if model is None:
+            return []
+        with sudoku_phase("parse"):
+            return sudoku_decode(model, self.cnf.size, self.cnf.names, self.cnf.board)
+
+# portfolio backend: the same formula is given at once to several solvers, the
+# first definitive answer wins and the other solvers are killed. The engines are
+# SAT4J with a few of its configurations and the DIMACS solvers found on the
+# PATH; every engine reads the formula on its stdin and prints s/v lines
+PORTFOLIO_SAT4J = ["Default", "Glucose21", "MiniLearningHeapRsatExpSimp"]
+# seconds between two looks at the stop event of a portfolio solve
+STOP_POLL = 0.05
+PORTFOLIO_SOLVERS = [["kissat", "-q"], ["cadical", "-q"], ["cryptominisat5", "--verb=0"],
+                     ["lingeling", "-q"], ["picosat"]]
+
+# the (name, command) of the engines installed on this machine
+def sudoku_portfolio_engines():
+    engines = []
+    if shutil.which("java") is not None:
+        for config in PORTFOLIO_SAT4J:
+            engines.append(("sat4j-" + config, ["java", "-jar", SAT4J_JAR, config, "/dev/stdin"]))
+    for command in PORTFOLIO_SOLVERS:
+        if shutil.which(command[0]) is not None:
+            engines.append((command[0], command))
+    return engines
+
+# races the engines on the formula cnf, returns the solution of the first one
+# that answers SATISFIABLE or UNSATISFIABLE ([] if it has no solution) with the
+# name of this engine; raises SudokuUnknown if no engine could tell before the
+# deadline or before the threading.Event stop is set, which kills the engines
+def sudoku_solve_portfolio(cnf, engines=None, stop=None):
+    if engines is None:
+        engines = sudoku_portfolio_engines()
+    with sudoku_phase("send"):
+        text = "p cnf " + str(cnf.nvars) + " " + str(cnf.nclauses) + "\n" + cnf.dimacs_body()
+    answers = queue.Queue()
+    processes = []
+
+    # one thread per engine feeds it the formula and collects its answer
+    def run(name, process):
+        try:
+            output, _ = process.communicate(text)
+        except (OSError, ValueError):
+            output = ""
+        answers.put((name, output.splitlines()))
+
+    threads = []
+    for name, command in engines:
+        try:
+            command, limit = sudoku_limited(command)
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL, text=True, start_new_session=True,
+                                       preexec_fn=limit)
+        except OSError:
             continue
+        processes.append(process)
+        threads.append(threading.Thread(target=run, args=(name, process), daemon=True))
+        threads[-1].start()
+    winner, lines = None, []
+    deadline = None if SOLVE_TIMEOUT is None else time.monotonic() + SOLVE_TIMEOUT
+    with sudoku_phase("search", engines=len(threads)):
+        pending = len(threads)
+        while pending > 0:
+            # the stop event is polled every STOP_POLL seconds
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if stop is not None:
+                timeout = STOP_POLL if timeout is None else min(timeout, STOP_POLL)
+            try:
+                name, output = answers.get(timeout=timeout)
+            except queue.Empty:
+                if stop is not None and stop.is_set():
+                    lines = ["c stopped"]
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    lines = ["c no answer within " + str(SOLVE_TIMEOUT) + "s"]
+                    break
+                continue
+            pending -= 1
+            if "s SATISFIABLE" in output or "s UNSATISFIABLE" in output:
+                winner, lines = name, output
+                break
+        for process in processes:
+            if process.poll() is None:
+                sudoku_kill(process)
+        for thread in threads:
+            thread.join()
+    if PROFILE is not None:
+        PROFILE.note("search", engine=winner)
+    with sudoku_phase("parse"):
+        return sudoku_parse_output(lines, cnf), winner
+
+# same interface as ColdSession for the portfolio backend; winner is the name
+# of the engine that answered the last solve
+class PortfolioSession:
+    def __init__(self, cnf, stop=None):
+        self.cnf = cnf.copy()
+        self.stop = stop
+        self.winner = None
+
+    def add_clause(self, clause):
+        self.cnf.add_clause(clause)
+
+    def solve(self, assumptions=()):
+        cnf = self.cnf.copy()
+        for lit in assumptions:
+            cnf.add_clause((lit,))
+        solution, self.winner = sudoku_solve_portfolio(cnf, stop=self.stop)
+        return solution
+
+BACKENDS = ["sat4j", "cdcl", "portfolio"]
+
+# opens a solving session on the formula with the chosen backend; the cdcl and
+# portfolio solves give up (SudokuUnknown) once the threading.Event stop is set
+def sudoku_session(cnf, backend="sat4j", stop=None):
+    if backend == "cdcl":
+        return CDCLSession(cnf, stop)
+    if backend == "portfolio":
+        return PortfolioSession(cnf, stop)
+    worker = sudoku_worker()
+    if worker is not None:
+        return WorkerSession(worker, cnf)
+    return ColdSession(cnf)
+
+# the clues of a sudoku as literals, e.g. to be passed as assumptions
+def sudoku_clues(sudoku):
+    N = len(sudoku)
+    return [cell * N + number for cell, number in enumerate(sudoku_cells(sudoku)) if number > 0]
+
+# solves the formula cnf with SAT4J: the DIMACS text is piped to the solver as it
+# is formatted and the model is decoded as its lines arrive, no file is written
+def sudoku_solve(cnf):
+    parse = lambda lines: sudoku_parse_output(lines, cnf)
+    worker = sudoku_worker()
+    if worker is not None:
+        return worker.request("solve", cnf, parse)
+    # no worker: one JVM launch for this solve, killed at the deadline
+    with sudoku_phase("send"):
+        command, limit = sudoku_limited(["java", "-jar", SAT4J_JAR, "/dev/stdin"])
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, text=True, start_new_session=True,
+                                   preexec_fn=limit)
+        watchdog = sudoku_watchdog(lambda: sudoku_kill(process))
+        try:
+            cnf.write_dimacs(process.stdin)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+    # JVM start, search and parse together
+    with sudoku_phase("search"):
+        try:
+            return parse(line.rstrip("\n") for line in process.stdout)
+        except SudokuUnknown:
+            # the watchdog has already fired: the JVM was killed at the deadline
+            if watchdog is not None and watchdog.finished.is_set():
+                raise SudokuUnknown("no answer from SAT4J within " + str(SOLVE_TIMEOUT) + "s")
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            sudoku_kill(process)
+            process.stdout.close()
+            process.wait()
+
+# symmetries of the sudokus: transposition, permutations of the bands (groups
+# of n rows), of the rows inside a band, of the stacks and of the columns
+# inside a stack, and relabeling of the numbers. The canonical form of a grid
+# is the smallest, read row by row, of its images where the numbers are
+# relabeled in order of first appearance. Only the orders of the rows and
+# columns compatible with invariant signatures are tried: the signature of a
+# row is made of its clues' column counts and number frequencies, which no
+# symmetry changes. When there are more than CANONICAL_LIMIT orders to try (very
+# sparse or very regular grids), the first one is used: the form may then
+# differ between equivalent grids, which only costs a cache miss.
+CANONICAL_LIMIT = 2000
+
+# consecutive items of the sorted list with the same key
+def sudoku_tie_groups(items, key):
+    groups = []
+    for item in items:
+        if groups and key(groups[-1][0]) == key(item):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
+# index orders of the N lines (rows or columns) with the units (bands or stacks)
+# sorted by signature and the lines sorted by signature inside every unit, one
+# order per way of ordering the equal signatures; only the first one when
+# there are more than limit of them
+def sudoku_line_orders(keys, n, limit):
+    unit_key = lambda u: sorted(keys[u * n:(u + 1) * n])
+    unit_groups = sudoku_tie_groups(sorted(range(n), key=unit_key), unit_key)
+    line_groups = [sudoku_tie_groups(sorted(range(u * n, (u + 1) * n), key=lambda line: keys[line]),
+                                     lambda line: keys[line]) for u in range(n)]
+    count = 1
+    for group in unit_groups + [group for groups in line_groups for group in groups]:
+        count *= math.factorial(len(group))
+    if count > limit:
+        return [[line for group in unit_groups for u in group for groups in [line_groups[u]]
+                 for lines in groups for line in lines]]
+    inside = [[[line for part in parts for line in part]
+               for parts in itertools.product(*[itertools.permutations(group) for group in groups])]
+              for groups in line_groups]
+    orders = []
+    for parts in itertools.product(*[itertools.permutations(group) for group in unit_groups]):
+        units = [u for part in parts for u in part]
+        for lines in itertools.product(*[inside[u] for u in units]):
+            orders.append([line for part in lines for line in part])
+    return orders
+
+# canonical form of a sudoku and the transformation (transpose, rows, cols,
+# labels) giving it: canonical[i][j] = labels[grid[rows[i]][cols[j]]], grid being
+# the sudoku, transposed when transpose is True
+def sudoku_canonical(sudoku):
+    N = len(sudoku)
+    n = math.isqrt(N)
+    best = None
+    for transpose in (False, True):
+        grid = [list(line) for line in zip(*sudoku)] if transpose else list(sudoku)
+        frequency = [0] * (N + 1)
+        for line in grid:
+            for number in line:
+                frequency[number] += 1
+        row_count = [sum(1 for number in line if number > 0) for line in grid]
+        col_count = [sum(1 for i in range(N) if grid[i][j] > 0) for j in range(N)]
+        row_keys = [(row_count[i], sorted((col_count[j], frequency[grid[i][j]]) for j in range(N) if grid[i][j] > 0))
+                    for i in range(N)]
+        col_keys = [(col_count[j], sorted((row_count[i], frequency[grid[i][j]]) for i in range(N) if grid[i][j] > 0))
+                    for j in range(N)]
+        all_rows = sudoku_line_orders(row_keys, n, CANONICAL_LIMIT)
+        all_cols = sudoku_line_orders(col_keys, n, CANONICAL_LIMIT)
+        if len(all_rows) * len(all_cols) > CANONICAL_LIMIT:
+            all_rows, all_cols = all_rows[:1], all_cols[:1]
+        for rows in all_rows:
+            for cols in all_cols:
+                labels = {0: 0}
+                form = []
+                for i in rows:
+                    line = grid[i]
+                    for j in cols:
+                        number = line[j]
+                        if number not in labels:
+                            labels[number] = len(labels)
+                        form.append(labels[number])
+                if best is None or form < best[0]:
+                    best = (form, (transpose, rows, cols, labels))
+    form, transform = best
+    return [form[i * N:(i + 1) * N] for i in range(N)], transform
+
+# complete relabeling of a transformation: the numbers missing from the grid
+# are given the remaining labels in increasing order
+def sudoku_labels(transform, N):
+    labels = dict(transform[3])
+    missing = [number for number in range(1, N + 1) if number not in labels]
+    for number, label in zip(missing, range(len(labels), N + 1)):
+        labels[number] = label
+    return labels
+
+# image of a full grid (e.g. a solution) of the original orientation
+def sudoku_transform(solution, transform):
+    transpose, rows, cols, labels = transform
+    labels = sudoku_labels(transform, len(solution))
+    grid = [list(line) for line in zip(*solution)] if transpose else list(solution)
+    return [[labels[grid[i][j]] for j in cols] for i in rows]
+
+# full grid of the canonical orientation mapped back to the original one
+def sudoku_transform_back(solution, transform):
+    transpose, rows, cols, labels = transform
+    N = len(solution)
+    inverse = {label: number for number, label in sudoku_labels(transform, N).items()}
+    solution = list(solution)
+    grid = [[0] * N for i in range(N)]
+    for a, i in enumerate(rows):
+        for b, j in enumerate(cols):
+            grid[i][j] = inverse[solution[a][b]]
+    return [list(line) for line in zip(*grid)] if transpose else grid
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sudoku-cache.sqlite")
+
+# persistent cache of the solutions, keyed by canonical form, so that a puzzle
+# equivalent to a solved one is answered without solving. An entry holds the
+# solution ("" if none), and once known whether it is unique, with the other
+# solution when it is not. At most limit entries are kept, the least recently
+# used ones are evicted first.
+class SolutionCache:
+    def __init__(self, path=CACHE_PATH, limit=100000):
+        self.limit = limit
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, solution TEXT, "
+                                "is_unique INTEGER, other TEXT, used REAL)")
+        # hits are only written with the next put or on close
+        self.used = {}
+
+    # (solution, other solution) in the orientation of sudoku, [] for none and
+    # other None while unknown, or None if sudoku is not in the cache. The grids
+    # of a hit are checked against sudoku: an entry that does not pass (a wrong
+    # answer stored by an earlier run, a damaged row) is evicted and is a miss
+    def get(self, sudoku):
+        canonical, transform = sudoku_canonical(sudoku)
+        key = sudoku_format_line(canonical)
+        row = self.connection.execute("SELECT solution, is_unique, other FROM solutions WHERE key = ?",
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            solution = [] if row[0] == "" else sudoku_transform_back(sudoku_parse_line(row[0]), transform)
+            if row[1] is None or solution == []:
+                other = None if solution != [] else []
+            elif row[1]:
+                other = []
+            else:
+                other = sudoku_transform_back(sudoku_parse_line(row[2]), transform)
+        except (SudokuFormatError, KeyError, IndexError, TypeError):
+            solution = other = None
+        if solution is None or (solution != [] and not sudoku_check(sudoku, solution)) \
+                or (other and (other == solution or not sudoku_check(sudoku, other))):
+            self.evict(key)
+            return None
+        self.used[key] = time.time()
+        return solution, other
+
+    def evict(self, key):
+        self.used.pop(key, None)
+        with self.connection:
+            self.connection.execute("DELETE FROM solutions WHERE key = ?", (key,))
+
+    # other is [] for a unique solution, None if unknown
+    def put(self, sudoku, solution, other=None):
+        canonical, transform = sudoku_canonical(sudoku)
+        key = sudoku_format_line(canonical)
+        text = "" if solution == [] else sudoku_format_line(sudoku_transform(solution, transform))
+        is_unique = None if other is None else other == []
+        other = None if not other else sudoku_format_line(sudoku_transform(other, transform))
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)",
+                                    (key, text, is_unique, other, time.time()))
+            self.flush()
+            count = self.connection.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+            if count > self.limit:
+                self.connection.execute("DELETE FROM solutions WHERE key IN "
+                                        "(SELECT key FROM solutions ORDER BY used LIMIT ?)", (count - self.limit,))
+
+    def flush(self):
+        self.connection.executemany("UPDATE solutions SET used = ? WHERE key = ?",
+                                    [(used, key) for key, used in self.used.items()])
+        self.used = {}
+
+    def close(self):
+        with self.connection:
+            self.flush()
+        self.connection.close()
+
+SOLUTION_CACHE = None
+
+# returns the shared cache, or None if it cannot be opened
+def sudoku_cache():
+    global SOLUTION_CACHE
+    if SOLUTION_CACHE is None:
+        try:
+            cache = SolutionCache()
+        except sqlite3.Error:
+            return None
+        atexit.register(cache.close)
+        SOLUTION_CACHE = cache
+    return SOLUTION_CACHE
+
+# formula and assumptions to solve a sudoku: with preprocess, the reduced
+# formula left by propagation (cnf is None when propagation found a
+# contradiction), otherwise the generic template with the clues as assumptions
+def sudoku_prepare(sudoku, preprocess=True, encoding=None):
+    with sudoku_phase("encode"):
+        if isinstance(sudoku, Board) and sudoku.conflicts > 0:
+            return None, []
+        if not preprocess:
+            return sudoku_generic_cnf(len(sudoku), encoding), sudoku_clues(sudoku)
+        with sudoku_phase("preprocess"):
+            reduced = sudoku_preprocess(sudoku)
+        if reduced is None:
+            return None, []
+        board, candidates = reduced
+        return sudoku_reduced_cnf(board, candidates, encoding), []
+
+# solves a sudoku given as a list of lists, returns [] if it has no solution
+# (looked up in cache and then stored in it, when given); the SudokuUnknown
+# raised when the solver cannot tell carries the grid completed by propagation
+def sudoku_solve_grid(sudoku, backend="sat4j", preprocess=True, encoding=None, cache=None):
+    if cache is not None:
+        cached = cache.get(sudoku)
+        if cached is not None:
+            return cached[0]
+    cnf, clues = sudoku_prepare(sudoku, preprocess, encoding)
+    if cnf is None:
+        solution = []
+    elif cnf.nvars == 0:
+        solution = cnf.board
+    else:
+        try:
+            solution = sudoku_session(cnf, backend=backend).solve(clues)
+        except SudokuUnknown as e:
+            e.partial = cnf.board or sudoku
+            raise
+    if cache is not None:
+        cache.put(sudoku, solution, [] if cnf is not None and cnf.nvars == 0 else None)
+    return solution
+
+# asyncio version of sudoku_solve: the JVM is run with create_subprocess_exec
+# so that the event loop is never blocked; if the task is cancelled or the
+# deadline passes, the JVM is killed
+async def sudoku_solve_cnf_async(cnf):
+    command, limit = sudoku_limited(["java", "-jar", SAT4J_JAR, "/dev/stdin"])
+    process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.DEVNULL, start_new_session=True,
+                                                   preexec_fn=limit)
+
+    async def communicate():
+        process.stdin.write(("p cnf " + str(cnf.nvars) + " " + str(cnf.nclauses) + "\n").encode())
+        for chunk in cnf.dimacs_chunks():
+            process.stdin.write(chunk.encode())
+            await process.stdin.drain()
+        process.stdin.close()
+        lines = [line.decode("utf-8").rstrip("\n") async for line in process.stdout]
+        await process.wait()
+        return lines
+
+    try:
+        lines = await asyncio.wait_for(communicate(), SOLVE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise SudokuUnknown("no answer from SAT4J within " + str(SOLVE_TIMEOUT) + "s")
+    finally:
+        if process.returncode is None:
+            sudoku_kill(process)
+            await process.wait()
+    return sudoku_parse_output(lines, cnf)
+
+# the formula of sudoku with its clues as unit clauses, as (cnf, None), or
+# (None, solution) when the preprocessing alone tells the solution ([] if none)
+def sudoku_formula(sudoku, preprocess=True, encoding=None):
+    cnf, clues = sudoku_prepare(sudoku, preprocess, encoding)
+    if cnf is None:
+        return None, []
+    if cnf.nvars == 0:
+        return None, cnf.board
+    if clues:
+        cnf = cnf.copy()
+        for lit in clues:
+            cnf.add_clause((lit,))
+    return cnf, None
+
+# the cdcl and portfolio solves of sudoku_solve_async, run in a thread from the
+# preparation on; they give up (SudokuUnknown) once the threading.Event stop is
+# set, which is also looked at between the preparation, loading and search
+def sudoku_solve_stoppable(sudoku, backend, preprocess, encoding, stop):
+    cnf, clues = sudoku_prepare(sudoku, preprocess, encoding)
+    if cnf is None:
+        return []
+    if cnf.nvars == 0:
+        return cnf.board
+    if stop.is_set():
+        raise SudokuUnknown("stopped before the solver was loaded")
+    session = sudoku_session(cnf, backend, stop)
+    if stop.is_set():
+        raise SudokuUnknown("stopped before the search")
+    return session.solve(clues)
+
+# asyncio version of sudoku_solve_grid, e.g. await sudoku_solve_async(sudoku);
+# with a semaphore, at most its value of solvers run at the same time. The
+# formula is built in a thread of the default executor, where the cdcl and
+# portfolio backends also run: cancelling the task stops their solver
+async def sudoku_solve_async(sudoku, backend="sat4j", preprocess=True, encoding=None, semaphore=None):
+    if semaphore is not None:
+        async with semaphore:
+            return await sudoku_solve_async(sudoku, backend, preprocess, encoding)
+    loop = asyncio.get_running_loop()
+    if backend in ["cdcl", "portfolio"]:
+        stop = threading.Event()
+        try:
+            return await loop.run_in_executor(None, sudoku_solve_stoppable, sudoku, backend,
+                                              preprocess, encoding, stop)
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+    cnf, solution = await loop.run_in_executor(None, sudoku_formula, sudoku, preprocess, encoding)
+    if cnf is None:
+        return solution
+    return await sudoku_solve_cnf_async(cnf)
+
+# solves many sudokus with at most jobs solvers at the same time (default: one per
+# CPU), yields the pairs (index of the sudoku, solution) as they are found:
+#   async for index, solution in sudoku_solve_as_completed(sudokus): ...
+# the solves still running are cancelled when the loop is left early
+async def sudoku_solve_as_completed(sudokus, jobs=None, backend="sat4j", preprocess=True, encoding=None):
+    semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+
+    async def solve(index, sudoku):
+        return index, await sudoku_solve_async(sudoku, backend, preprocess, encoding, semaphore)
+
+    tasks = [asyncio.ensure_future(solve(index, sudoku)) for index, sudoku in enumerate(sudokus)]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# the puzzle sudoku has no solution other than solution, checked with a formula
+# of its own: True, False, or None when the solver cannot tell before the deadline
+def sudoku_unique(sudoku, solution, backend="sat4j", preprocess=True, encoding=None):
+    cnf, clues = sudoku_prepare(sudoku, preprocess, encoding)
+    if cnf is None:
+        return False
+    if cnf.nvars == 0:
+        return True
+    cnf = cnf.copy()
+    sudoku_other_solution_constraint(cnf, solution, cnf.names, sudoku)
+    try:
+        return sudoku_session(cnf, backend).solve(clues) == []
+    except SudokuUnknown:
+        return None
+
+# the solutions of a sudoku, at most limit of them, found in one solver session
+# where every solution is blocked before looking for the next one
+def sudoku_solutions(sudoku, limit, backend="sat4j", preprocess=True, encoding=None):
+    cnf, clues = sudoku_prepare(sudoku, preprocess, encoding)
+    if cnf is None or limit < 1:
+        return
+    if cnf.nvars == 0:
+        yield cnf.board
+        return
+    session = sudoku_session(cnf, backend)
+    for count in range(limit):
+        solution = session.solve(clues)
+        if solution == []:
+            return
+        yield solution
+        sudoku_other_solution_constraint(session, solution, cnf.names, sudoku)
+
+# incremental uniqueness queries about the puzzles of one solution: a single
+# solver session holds the generic formula and a clause asking for a grid other
+# than the solution, and every query only passes the clues of the puzzle as
+# assumptions, so the session keeps what it learned from one query to the next.
+# With preprocess, the assumptions are the cells filled by propagation, and
+# no query is needed when propagation alone fills the grid.
+# Opened by the first query of a process, for (solution, backend, encoding)
+UNIQUENESS_SESSION = None
+
+# the puzzle has no solution other than solution: True, False, or None when the
+# solver cannot tell before the deadline
+def sudoku_unique_incremental(puzzle, solution, backend="sat4j", preprocess=True, encoding=None):
+    global UNIQUENESS_SESSION
+    if preprocess:
+        reduced = sudoku_preprocess(puzzle)
+        if reduced is None:
+            return False
+        puzzle = reduced[0]
+        if all(all(line) for line in puzzle):
+            return True
+    key = (solution, backend, encoding)
+    if UNIQUENESS_SESSION is None or UNIQUENESS_SESSION[0] != key:
+        session = sudoku_session(sudoku_generic_cnf(len(solution), encoding), backend)
+        sudoku_other_solution_constraint(session, solution)
+        UNIQUENESS_SESSION = (key, session)
+    try:
+        return UNIQUENESS_SESSION[1].solve(sudoku_clues(puzzle)) == []
+    except SudokuUnknown:
+        return None
+
+# settings of the run that the processes of a pool get from sudoku_pool_init:
+# they only inherit the globals set by the command line when they are forked
+def sudoku_pool_settings():
+    return VERBOSE, SOLVE_TIMEOUT, SOLVE_MEMORY
+
+# a process of a pool forgets the solver worker and the cache of its parent and
+# opens its own; it is not profiled. It takes the settings of
+# sudoku_pool_settings() in the parent (pass them as initargs)
+def sudoku_pool_init(settings=None):
+    global SOLVER_WORKER, SOLUTION_CACHE, PROFILE, UNIQUENESS_SESSION, VERBOSE, SOLVE_TIMEOUT, SOLVE_MEMORY
+    SOLVER_WORKER = None
+    SOLUTION_CACHE = None
+    UNIQUENESS_SESSION = None
+    if PROFILE is not None:
+        PROFILE = None
+        tracemalloc.stop()
+    if settings is not None:
+        VERBOSE, SOLVE_TIMEOUT, SOLVE_MEMORY = settings
+
+# the generator traces its progress (grids, clue counts) on stdout; off for bulk generation
+VERBOSE = True
+
+# removes clues from puzzle (a copy is returned) as long as solution stays its
+# only solution. The cells (numbered i*N + j) are tried once each, in the given
+# order. Every round tests up to jobs removals at the same time, each one alone
+# against the current puzzle: a cell whose removal fails is proven necessary for
+# good, since removing more clues can only add solutions. The removals that pass
+# are committed together if the puzzle stays unique without all of them, else
+# only the first one is and the others go back in front of the pending cells, so the
+# result only depends on the order of the cells, not on the timing of the pool.
+# Every clue left has been checked, so the puzzle is minimal: no clue can be
+# removed without losing uniqueness (unless the solver could not tell for some
+# of them before the deadline, which is reported).
+# With SAT4J, the queries go to sudoku_unique_incremental: one session per
+# process, where each query costs a list of assumptions instead of a new
+# formula. The built-in CDCL solver is faster on the small formula left by
+# propagation than on the whole template, and the portfolio keeps no state from
+# one query to the next, so they get a formula per query from sudoku_unique.
+def sudoku_dig(puzzle, solution, cells, jobs=1, backend="sat4j", preprocess=True, encoding=None):
+    global UNIQUENESS_SESSION
+    N = len(puzzle)
+    puzzle = [list(line) for line in puzzle]
+    pending = [cell for cell in cells if puzzle[cell // N][cell % N] > 0]
+    necessary = set()
+    unique = functools.partial(sudoku_unique_incremental if backend == "sat4j" else sudoku_unique,
+                               solution=solution, backend=backend, preprocess=preprocess, encoding=encoding)
+    stats = {"queries": 0, "unknown": 0, "seconds": 0.0}
+    UNIQUENESS_SESSION = None
+    pool = multiprocessing.Pool(jobs, sudoku_pool_init, (sudoku_pool_settings(),)) if jobs > 1 else None
+    try:
+        while pending:
+            with sudoku_phase("dig round", tried=min(jobs, len(pending))):
+                removable = sudoku_dig_round(puzzle, pending, necessary, jobs, unique, pool, stats)
+            for cell in removable:
+                puzzle[cell // N][cell % N] = 0
+            clues = sum(1 for line in puzzle for number in line if number > 0)
+            if PROFILE is not None:
+                PROFILE.note("dig round", removed=len(removable), clues=clues, necessary=len(necessary))
+            if VERBOSE:
+                print("Clues: " + str(clues) + ", proven necessary: " + str(len(necessary))
+                      + ", left to try: " + str(len(pending)))
+    finally:
+        UNIQUENESS_SESSION = None
+        if pool is not None:
+            pool.terminate()
+    if PROFILE is not None:
+        PROFILE.note("dig round", queries=stats["queries"], unknown=stats["unknown"], queries_s=stats["seconds"])
+    if VERBOSE:
+        print(("Minimal: " if stats["unknown"] == 0 else "Not proven minimal, " + str(stats["unknown"])
+               + " queries without answer: ") + str(stats["queries"]) + " uniqueness queries in %.3fs" % stats["seconds"])
+    return puzzle
+
+# one round of sudoku_dig: takes the cells to try from the front of pending,
+# returns the ones to remove; the cells proven necessary are added to necessary
+# and the removals to try again are put back in front of pending. The queries and
+# their time are counted in stats
+def sudoku_dig_round(puzzle, pending, necessary, jobs, unique, pool, stats):
+    N = len(puzzle)
+    batch = pending[:jobs]
+    del pending[:jobs]
+    trials = []
+    for cell in batch:
+        trial = [list(line) for line in puzzle]
+        trial[cell // N][cell % N] = 0
+        trials.append(trial)
+    start = time.perf_counter()
+    results = pool.map(unique, trials) if pool is not None else [unique(trial) for trial in trials]
+    stats["queries"] += len(trials)
+    stats["unknown"] += results.count(None)
+    removable = []
+    for cell, result in zip(batch, results):
+        if result:
+            removable.append(cell)
+        else:
+            necessary.add(cell)
+    if len(removable) > 1:
+        trial = [list(line) for line in puzzle]
+        for cell in removable:
+            trial[cell // N][cell % N] = 0
+        stats["queries"] += 1
+        if not unique(trial):
+            pending[:0] = removable[1:]
+            removable = removable[:1]
+    stats["seconds"] += time.perf_counter() - start
+    return removable
+
+# attempts at a solution grid, each one from another random clue, when the
+# solver gives no answer before the deadline
+GENERATE_ATTEMPTS = 3
+
+# a random solution of the given size, and a random order of its cells; raises
+# SudokuUnknown when no attempt found one before the deadline
+def sudoku_generate_solution(size, rng, backend="sat4j", encoding=None):
+    for attempt in range(GENERATE_ATTEMPTS):
+        sudoku = [[ 0 for _ in range(size)] for _ in range(size)]
+
+        # First, we need to generate a random solution
+
+        sudoku[rng.randint(0, size - 1)][rng.randint(0, size - 1)] = rng.randint(1, size)
+        if VERBOSE:
+            sudoku_print(sys.stdout, sudoku)
 
-        # Remove the number
-        sudoku[row][col] = 0
-
-        with open("sudoku.cnf", 'w') as myfile:
-            myfile.write("p cnf " + str(size**2) + str(size).zfill(2)  +" "+
-                        str(sudoku_constraints_number(sudoku))+"\n")
-            sudoku_generic_constraints(myfile, size)
-            sudoku_specific_constraints(myfile, sudoku)
+        try:
+            sudoku = sudoku_solve_grid(sudoku, backend, True, encoding)
+            break
+        except SudokuUnknown as e:
+            if attempt == GENERATE_ATTEMPTS - 1:
+                raise
+            if VERBOSE:
+                print("unknown (" + str(e) + "), trying another clue")
+    if VERBOSE:
+        sudoku_print(sys.stdout, sudoku)
+
+    cells = list(range(size * size))
+    rng.shuffle(cells)
+    return sudoku, cells
+
+# creates a puzzle with a unique solution from which no clue can be removed;
+# the same seed gives the same puzzle, whatever the number of jobs
+import random
+def sudoku_generate(size, backend="sat4j", encoding=None, jobs=1, seed=None, preprocess=True):
+    rng = random.Random(seed)
+    solution, cells = sudoku_generate_solution(size, rng, backend, encoding)
 
-        temp = sudoku_solve("sudoku.cnf")
+    if VERBOSE:
+        print("Solution found, starting to remove numbers...")
+    return sudoku_dig(solution, solution, cells, jobs, backend, preprocess, encoding)
 
-        with open("sudoku.cnf", 'a') as myfile:
-            sudoku_other_solution_constraint(myfile, temp)
+# same, after removing every number == size from the solution
+def sudoku_generate_cm(size, backend="sat4j", encoding=None, jobs=1, seed=None, preprocess=True):
+    rng = random.Random(seed)
+    solution, cells = sudoku_generate_solution(size, rng, backend, encoding)
 
-        solvable = sudoku_solve(sudoku)
-        print("Health: " + str(health))
-        if solvable == []:
-            continue
+    # Remove ever number == size
+    sudoku = [[0 if number == size else number for number in line] for line in solution]
+    if VERBOSE:
+        sudoku_print(sys.stdout, sudoku)
+        print("Solution found, starting to remove numbers...")
+    return sudoku_dig(sudoku, solution, cells, jobs, backend, preprocess, encoding)
+
+# puzzle number index of a bulk generation: each one has its own random
+# generator, seeded with seed and index when a seed is given. A puzzle whose
+# solution grid could not be found before the deadline is returned as the
+# SudokuUnknown, so that the other puzzles of the run are kept
+def sudoku_generate_indexed(index, size, cm=False, backend="sat4j", encoding=None, seed=None, preprocess=True):
+    generate = sudoku_generate_cm if cm else sudoku_generate
+    try:
+        return generate(size, backend, encoding, 1, None if seed is None else str(seed) + "/" + str(index),
+                        preprocess)
+    except SudokuUnknown as e:
+        return SudokuUnknown("puzzle " + str(index) + ": unknown, " + str(e))
+
+# generates count puzzles with jobs processes, each one with its own solver
+# worker, and writes them to myfile in the output format form as they are
+# finished (pipe grids separated by an empty line); the puzzles given up are
+# reported on stderr. Returns the number of puzzles written
+def sudoku_generate_many(size, count, myfile, jobs=1, cm=False, backend="sat4j", encoding=None,
+                         seed=None, preprocess=True, form="line"):
+    generate = functools.partial(sudoku_generate_indexed, size=size, cm=cm, backend=backend,
+                                 encoding=encoding, seed=seed, preprocess=preprocess)
+    written = 0
+    with multiprocessing.Pool(min(jobs, count), sudoku_pool_init, (sudoku_pool_settings(),)) as pool:
+        for sudoku in pool.imap_unordered(generate, range(count)):
+            if isinstance(sudoku, SudokuUnknown):
+                sys.stderr.write(str(sudoku) + "\n")
+                continue
+            myfile.write(sudoku_render(sudoku, form) + ("\n" if form == "pipe" else ""))
+            myfile.flush()
+            written += 1
+    return written
+
+# checks that solution is a complete and valid sudoku that keeps the clues of sudoku
+def sudoku_check(sudoku, solution):
+    N = len(sudoku)
+    if len(solution) != N or any(len(line) != N for line in solution):
+        return False
+    if isinstance(solution, Board):
+        if solution.clues != N * N or solution.conflicts > 0:
+            return False
+    else:
+        units, peers = sudoku_units(N)
+        flat = sudoku_cells(solution)
+        for unit in units:
+            if sorted(flat[cell] for cell in unit) != list(range(1, N + 1)):
+                return False
+    return all(given in (0, number) for given, number in zip(sudoku_cells(sudoku), sudoku_cells(solution)))
+
+# puzzles of the batch mode: every .txt file of a directory, or a glob pattern
+def sudoku_batch_files(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.txt")
+    return sorted(glob.glob(pattern))
+
+# solves one puzzle of a batch, returns (filename, puzzle, solution, seconds, error);
+# each process of the pool has its own solver worker
+def sudoku_batch_solve(filename, backend="sat4j", preprocess=True, encoding=None):
+    start = time.perf_counter()
+    try:
+        sudoku = sudoku_read(filename)
+        cnf, clues = sudoku_prepare(sudoku, preprocess, encoding)
+        if cnf is None:
+            solution = []
+        elif cnf.nvars == 0:
+            solution = cnf.board
         else:
-            sudoku[row][col] = nb
-            health -= 1
-            if health == 0:
-                break
-        
-    return sudoku 
+            session = sudoku_session(cnf, backend)
+            solution = session.solve(clues)
+    except SudokuUnknown as e:
+        return filename, None, None, time.perf_counter() - start, "unknown, " + str(e)
+    except (SudokuFormatError, OSError) as e:
+        return filename, None, None, time.perf_counter() - start, str(e)
+    return filename, sudoku, solution, time.perf_counter() - start, None
+
+# solves all the puzzles of pattern with jobs processes, writes the solutions
+# in outdir and compares them with the files of the same name in refdir
+def sudoku_batch(pattern, jobs=None, outdir=None, refdir=None,
+                 backend="sat4j", preprocess=True, encoding=None, myfile=sys.stdout):
+    files = sudoku_batch_files(pattern)
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    solve = functools.partial(sudoku_batch_solve, backend=backend, preprocess=preprocess, encoding=encoding)
+    results = []
+    start = time.perf_counter()
+    # the processes of the pool are not profiled: the batch is one phase
+    with sudoku_phase("batch", puzzles=len(files), jobs=jobs), \
+            multiprocessing.Pool(jobs, sudoku_pool_init, (sudoku_pool_settings(),)) as pool:
+        for result in pool.imap_unordered(solve, files):
+            results.append(result)
+    wall = time.perf_counter() - start
+
+    passed = failed = unsolved = errors = 0
+    for filename, sudoku, solution, seconds, error in sorted(results):
+        name = os.path.basename(filename)
+        if error is not None:
+            status = "error: " + error
+            errors += 1
+        elif solution == [] and refdir is not None and os.path.exists(os.path.join(refdir, name)):
+            # the reference has a solution: not finding one is a regression
+            status = "FAIL: no solution"
+            failed += 1
+        elif solution == []:
+            status = "no solution"
+            unsolved += 1
+        else:
+            if outdir is not None:
+                with open(os.path.join(outdir, name), 'w') as outfile:
+                    sudoku_print(outfile, solution)
+            ok = sudoku_check(sudoku, solution)
+            if ok and refdir is not None:
+                reference = os.path.join(refdir, name)
+                try:
+                    ok = sudoku_read(reference) == solution
+                except (SudokuFormatError, OSError):
+                    ok = False
+            status = "pass" if ok else "FAIL"
+            if ok:
+                passed += 1
+            else:
+                failed += 1
+        myfile.write(name + " " + status + " " + "%.3f" % seconds + "s\n")
+    myfile.write("\n" + str(len(results)) + " puzzles: " + str(passed) + " pass, " + str(failed) + " fail, "
+                 + str(unsolved) + " without solution, " + str(errors) + " errors\n")
+    myfile.write("total %.3fs, %.3fs of solving" % (wall, sum(result[3] for result in results)) + "\n")
+    return passed, failed, unsolved, errors
 
 from enum import Enum
 class Mode(Enum):
@@ -415,58 +2454,285 @@ class Mode(Enum):
     UNIQUE = 2
     CREATE = 3
     CREATEMIN = 4
+    BATCH = 5
+    STREAM = 6
+    COUNT = 7
 
 OPTIONS = {}
 OPTIONS["-s"] = Mode.SOLVE
 OPTIONS["-u"] = Mode.UNIQUE
 OPTIONS["-c"] = Mode.CREATE
 OPTIONS["-cm"] = Mode.CREATEMIN
-
-if len(sys.argv) != 3 or not sys.argv[1] in OPTIONS :
-    sys.stdout.write("./sudokub.py <operation> <argument>\n")
-    sys.stdout.write("     where <operation> can be -s, -u, -c, -cm\n")
-    sys.stdout.write("  ./sudokub.py -s <input>.txt: solves the Sudoku in input, whatever its size\n")
-    sys.stdout.write("  ./sudokub.py -u <input>.txt: check the uniqueness of solution for Sudoku in input, whatever its size\n")
-    sys.stdout.write("  ./sudokub.py -c <size>: creates a Sudoku of appropriate <size>\n")
-    sys.stdout.write("  ./sudokub.py -cm <size>: creates a Sudoku of appropriate <size> using only <size>-1 numbers\n")
-    sys.stdout.write("    <size> is either 4, 9, 16, or 25\n")
-    exit("Bad arguments\n")
-
-mode = OPTIONS[sys.argv[1]]
-if mode == Mode.SOLVE or mode == Mode.UNIQUE:
-    filename = str(sys.argv[2])
-    sudoku = sudoku_read(filename)
-    N = len(sudoku)
-    myfile = open("sudoku.cnf", 'w')
-    # Notice that this may not be correct for N > 9
-    myfile.write("p cnf " + str(N*N) + str(N).zfill(2)  +" "+
-                 str(sudoku_constraints_number(sudoku))+"\n")
-    sudoku_generic_constraints(myfile, N)
-    sudoku_specific_constraints(myfile, sudoku)
-    myfile.close()
-    sys.stdout.write("sudoku\n")
-    sudoku_print(sys.stdout, sudoku)
-    sudoku = sudoku_solve("sudoku.cnf")    
-    sys.stdout.write("\nsolution\n")
-    sudoku_print(sys.stdout, sudoku)
-    if sudoku != [] and mode == Mode.UNIQUE:
-        myfile = open("sudoku.cnf", 'a')
-        sudoku_other_solution_constraint(myfile, sudoku)
-        myfile.close()
-        sudoku = sudoku_solve("sudoku.cnf")
-        if sudoku == []:
-            sys.stdout.write("\nsolution is unique\n")
+OPTIONS["-b"] = Mode.BATCH
+OPTIONS["-f"] = Mode.STREAM
+OPTIONS["-n"] = Mode.COUNT
+
+# flags are given as --name=value anywhere on the command line
+FLAGS = {}
+FLAGS["--backend"] = "sat4j"
+FLAGS["--preprocess"] = "on"
+FLAGS["--encoding"] = "auto"
+FLAGS["--jobs"] = str(os.cpu_count() or 1)
+FLAGS["--out"] = ""
+FLAGS["--ref"] = ""
+FLAGS["--seed"] = ""
+FLAGS["--enumerate"] = "off"
+FLAGS["--cnf"] = ""
+FLAGS["--cache"] = "on"
+FLAGS["--profile"] = ""
+FLAGS["--timeout"] = ""
+FLAGS["--memory"] = ""
+FLAGS["--count"] = ""
+FLAGS["--format"] = ""
+FLAGS["--quiet"] = "off"
+
+if __name__ == "__main__":
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--"):
+            name, _, value = arg.partition("=")
+            if name not in FLAGS or (value == "" and FLAGS[name] != ""):
+                exit("Bad flag " + arg + "\n")
+            FLAGS[name] = value
         else:
-            sys.stdout.write("\nother solution\n")
-            sudoku_print(sys.stdout, sudoku)
-elif mode == Mode.CREATE:
-    print("Creation mode")
-    size = int(sys.argv[2])
-    sudoku = sudoku_generate(size)
-    sys.stdout.write("\ngenerated sudoku\n")
-    sudoku_print(sys.stdout, sudoku)
-elif mode == Mode.CREATEMIN:
-    size = int(sys.argv[2])
-    sudoku = sudoku_generate_cm(size)
-    sys.stdout.write("\ngenerated sudoku\n")
-    sudoku_print(sys.stdout, sudoku)
\ No newline at end of file
+            args.append(arg)
+
+    if len(args) != (3 if args[:1] == ["-n"] else 2) or not args[0] in OPTIONS \
+            or (args[0] == "-n" and (not args[1].isdigit() or int(args[1]) < 1)) \
+            or (args[0] in ["-c", "-cm"] and (not args[1].isdigit() or not sudoku_valid_size(int(args[1])))) \
+            or FLAGS["--backend"] not in BACKENDS or FLAGS["--preprocess"] not in ["on", "off"] \
+            or FLAGS["--enumerate"] not in ["on", "off"] or FLAGS["--cache"] not in ["on", "off"] \
+            or FLAGS["--quiet"] not in ["on", "off"] or FLAGS["--format"] not in [""] + OUTPUT_FORMATS \
+            or (FLAGS["--encoding"] != "auto" and FLAGS["--encoding"] not in AMO_ENCODINGS) \
+            or not FLAGS["--jobs"].isdigit() or int(FLAGS["--jobs"]) < 1 \
+            or not (FLAGS["--timeout"] == "" or (FLAGS["--timeout"].replace(".", "", 1).isdigit() and float(FLAGS["--timeout"]) > 0)) \
+            or not (FLAGS["--memory"] == "" or FLAGS["--memory"].isdigit()) \
+            or not (FLAGS["--count"] == "" or (FLAGS["--count"].isdigit() and int(FLAGS["--count"]) >= 1)):
+        sys.stdout.write("./sudokub.py <operation> <argument>\n")
+        sys.stdout.write("     where <operation> can be -s, -u, -c, -cm, -b, -f, -n\n")
+        sys.stdout.write("  ./sudokub.py -s <input>.txt: solves the Sudoku in input, whatever its size\n")
+        sys.stdout.write("  ./sudokub.py -u <input>.txt: check the uniqueness of solution for Sudoku in input, whatever its size\n")
+        sys.stdout.write("  ./sudokub.py -c <size>: creates a Sudoku of appropriate <size>\n")
+        sys.stdout.write("  ./sudokub.py -cm <size>: creates a Sudoku of appropriate <size> using only <size>-1 numbers\n")
+        sys.stdout.write("  ./sudokub.py -b <directory or glob>: solves all the Sudokus in parallel and checks the solutions\n")
+        sys.stdout.write("  ./sudokub.py -f <puzzles>.txt: solves every Sudoku of a file of puzzles (- for stdin), one per line,\n")
+        sys.stdout.write("     or in the | format; prints one solution per line (impossible, unknown or error if none)\n")
+        sys.stdout.write("  ./sudokub.py -n <K> <puzzles>.txt: counts the solutions of every Sudoku of a file of puzzles\n")
+        sys.stdout.write("     (- for stdin), up to K\n")
+        sys.stdout.write("    <size> is n*n with n >= 2: 4, 9, 16, 25, 36, 49, 64...\n")
+        sys.stdout.write("  options:\n")
+        sys.stdout.write("    --backend=sat4j|cdcl|portfolio: SAT solver to use, SAT4J, the built-in CDCL solver, or\n")
+        sys.stdout.write("        a race between SAT4J configurations and the solvers on the PATH (default sat4j)\n")
+        sys.stdout.write("    --encoding=auto|pairwise|sequential|commander|product: encoding of the \"at most once\" constraints\n")
+        sys.stdout.write("        (default auto: the best one for the size)\n")
+        sys.stdout.write("    --preprocess=on|off: fill in naked and hidden singles before encoding (default on)\n")
+        sys.stdout.write("    --jobs=<n>: number of processes of -b, -c and -cm (default: number of cores)\n")
+        sys.stdout.write("    --seed=<seed>: -c and -cm create the same Sudoku for the same seed\n")
+        sys.stdout.write("    --count=<K>: -c and -cm create K Sudokus, one per line as for -f, with --jobs processes;\n")
+        sys.stdout.write("        they are written to --out as they are created (default stdout), without tracing\n")
+        sys.stdout.write("    --enumerate=on|off: -n also prints every solution, one per line (default off)\n")
+        sys.stdout.write("    --cnf=<file>: -s and -u also write the formula, DIMACS compressed if <file> ends with\n")
+        sys.stdout.write("        .gz or .xz, binary if it ends with .bin; it is written before preprocessing, variable\n")
+        sys.stdout.write("        (i*N + j)*N + k is number k in row i, column j, counted from 0\n")
+        sys.stdout.write("    --cache=on|off: -s, -u and -f look up the solutions of the puzzles equivalent by symmetry\n")
+        sys.stdout.write("        in .sudoku-cache.sqlite and store the new ones (default on)\n")
+        sys.stdout.write("    --profile=<file>.json: writes the time and peak memory of every phase of the run,\n")
+        sys.stdout.write("        with the statistics of the SAT solver\n")
+        sys.stdout.write("    --timeout=<seconds>: deadline of every solve; past it, the answer is unknown\n")
+        sys.stdout.write("        (-s and -u then print the cells found by propagation)\n")
+        sys.stdout.write("    --memory=<MB>: memory cap of every solver process; above it, the answer is unknown\n")
+        sys.stdout.write("    --format=pipe|line|json: output of the grids, | layout, one line as for -f, or JSON Lines\n")
+        sys.stdout.write("        records (default: pipe for -s, -u, -c and -cm, line for -f, -n and --count)\n")
+        sys.stdout.write("    --quiet=on|off: -s, -u, -c and -cm only print their results, without the input grid,\n")
+        sys.stdout.write("        the headers, the number of clauses or the tracing (default off)\n")
+        sys.stdout.write("    --out=<directory>: where -b writes the solutions (a file for -c and -cm with --count)\n")
+        sys.stdout.write("    --ref=<directory>: reference solutions -b compares with\n")
+        exit("Bad arguments\n")
+
+    mode = OPTIONS[args[0]]
+    encoding = None if FLAGS["--encoding"] == "auto" else FLAGS["--encoding"]
+    if FLAGS["--timeout"] != "":
+        SOLVE_TIMEOUT = float(FLAGS["--timeout"])
+    if FLAGS["--memory"] != "":
+        SOLVE_MEMORY = int(FLAGS["--memory"])
+    if FLAGS["--profile"] != "":
+        PROFILE = Profile()
+        atexit.register(PROFILE.write, FLAGS["--profile"], sys.argv)
+    if mode == Mode.SOLVE or mode == Mode.UNIQUE:
+        filename = str(args[1])
+        try:
+            with sudoku_phase("read"):
+                sudoku = sudoku_read(filename)
+        except SudokuFormatError as e:
+            exit(str(e) + "\n")
+        N = len(sudoku)
+        puzzle = sudoku
+        form = FLAGS["--format"] or "pipe"
+        quiet = FLAGS["--quiet"] == "on" or form == "json"
+        if not quiet:
+            sudoku_constraints_number(sudoku, encoding)
+        if FLAGS["--cnf"] != "":
+            # the formula before preprocessing, whose variables are the cells
+            sudoku_write_cnf(FLAGS["--cnf"], sudoku, encoding=encoding)
+        cache = sudoku_cache() if FLAGS["--cache"] == "on" else None
+        cached = None if cache is None else cache.get(sudoku)
+        winner = None
+        unknown = ""
+        if cached is not None and (mode == Mode.SOLVE or cached[1] is not None):
+            solution, other = cached
+        else:
+            cnf, clues = sudoku_prepare(sudoku, FLAGS["--preprocess"] == "on", encoding)
+            # propagation alone may already prove that there is no or only one solution
+            other = None
+            if cnf is None:
+                solution = []
+            elif cnf.nvars == 0:
+                solution = cnf.board
+                other = []
+            else:
+                session = sudoku_session(cnf, backend=FLAGS["--backend"])
+                try:
+                    solution = session.solve(clues)
+                except SudokuUnknown as e:
+                    # no solution before the deadline: the cells found by propagation instead
+                    if form == "json":
+                        sys.stdout.write(sudoku_json(puzzle=sudoku, solution=None, unknown=str(e),
+                                                     partial=cnf.board or sudoku))
+                    elif quiet:
+                        sys.stdout.write("unknown: " + str(e) + "\n" + sudoku_render(cnf.board or sudoku, form))
+                    else:
+                        sys.stdout.write("sudoku\n" + sudoku_render(sudoku, form) + "\nunknown: " + str(e)
+                                         + "\n\ncells found by propagation\n" + sudoku_render(cnf.board or sudoku, form))
+                    exit(1)
+                winner = getattr(session, "winner", None)
+                if solution != [] and mode == Mode.UNIQUE:
+                    sudoku_other_solution_constraint(session, solution, cnf.names, puzzle)
+                    try:
+                        other = session.solve(clues)
+                    except SudokuUnknown as e:
+                        unknown = str(e)
+            if cache is not None:
+                cache.put(puzzle, solution, other)
+        if form == "json":
+            record = {"puzzle": sudoku, "solution": None if solution == [] else solution}
+            if solution != [] and mode == Mode.UNIQUE:
+                record["unique"] = None if other is None else other == []
+                if other:
+                    record["other"] = other
+                if unknown:
+                    record["unknown"] = unknown
+            if winner is not None:
+                record["engine"] = winner
+            sys.stdout.write(sudoku_json(**record))
+            exit(0)
+        # the whole answer is written at once
+        text = [] if quiet else ["sudoku\n", sudoku_render(sudoku, form), "\nsolution\n"]
+        text.append(sudoku_render(solution, form))
+        if winner is not None and not quiet:
+            text.append("\nsolved by " + winner + "\n")
+        if solution != [] and mode == Mode.UNIQUE:
+            if other == []:
+                text.append("unique\n" if quiet else "\nsolution is unique\n")
+            elif other is None:
+                text.append(("" if quiet else "\n") + "uniqueness unknown: " + unknown + "\n")
+            else:
+                text.append("" if quiet else "\nother solution\n")
+                text.append(sudoku_render(other, form))
+        sys.stdout.write("".join(text))
+    elif (mode == Mode.CREATE or mode == Mode.CREATEMIN) and FLAGS["--count"] != "":
+        VERBOSE = False
+        start = time.perf_counter()
+        with (open(FLAGS["--out"], 'w') if FLAGS["--out"] else contextlib.nullcontext(sys.stdout)) as myfile:
+            written = sudoku_generate_many(int(args[1]), int(FLAGS["--count"]), myfile, int(FLAGS["--jobs"]),
+                                           mode == Mode.CREATEMIN, FLAGS["--backend"], encoding,
+                                           FLAGS["--seed"] or None, FLAGS["--preprocess"] == "on",
+                                           FLAGS["--format"] or "line")
+        sys.stderr.write(str(written) + " puzzles created in %.3fs\n" % (time.perf_counter() - start))
+        if written < int(FLAGS["--count"]):
+            exit(1)
+    elif mode == Mode.CREATE or mode == Mode.CREATEMIN:
+        form = FLAGS["--format"] or "pipe"
+        quiet = FLAGS["--quiet"] == "on" or form == "json"
+        VERBOSE = not quiet
+        if mode == Mode.CREATE and not quiet:
+            print("Creation mode")
+        size = int(args[1])
+        generate = sudoku_generate if mode == Mode.CREATE else sudoku_generate_cm
+        try:
+            sudoku = generate(size, FLAGS["--backend"], encoding, int(FLAGS["--jobs"]),
+                              FLAGS["--seed"] or None, FLAGS["--preprocess"] == "on")
+        except SudokuUnknown as e:
+            exit("unknown: " + str(e) + "\n")
+        sys.stdout.write(("" if quiet else "\ngenerated sudoku\n") + sudoku_render(sudoku, form))
+    elif mode == Mode.BATCH:
+        passed, failed, unsolved, errors = sudoku_batch(args[1], int(FLAGS["--jobs"]), FLAGS["--out"] or None,
+                                                        FLAGS["--ref"] or None, FLAGS["--backend"],
+                                                        FLAGS["--preprocess"] == "on", encoding)
+        if failed + errors > 0:
+            exit(1)
+    elif mode == Mode.STREAM:
+        form = FLAGS["--format"] or "line"
+        cache = sudoku_cache() if FLAGS["--cache"] == "on" else None
+        errors = 0
+        for lineno, sudoku in sudoku_stream(sys.stdin if args[1] == "-" else args[1]):
+            # every record gives one answer, so that the output matches the input
+            if isinstance(sudoku, SudokuFormatError):
+                sys.stderr.write(str(sudoku) + "\n")
+                if form == "json":
+                    sys.stdout.write(sudoku_json(line=lineno, status="error", solution=None, error=str(sudoku)))
+                else:
+                    sys.stdout.write("error\n" + ("\n" if form == "pipe" else ""))
+                errors += 1
+                continue
+            try:
+                sudoku = sudoku_solve_grid(sudoku, FLAGS["--backend"], FLAGS["--preprocess"] == "on", encoding, cache)
+            except SudokuUnknown as e:
+                sys.stderr.write("line " + str(lineno) + ": " + str(e) + "\n")
+                if form == "json":
+                    sys.stdout.write(sudoku_json(line=lineno, status="unknown", solution=None))
+                else:
+                    sys.stdout.write("unknown\n" + ("\n" if form == "pipe" else ""))
+                errors += 1
+                continue
+            if form == "json":
+                sys.stdout.write(sudoku_json(line=lineno, status="impossible" if sudoku == [] else "solved",
+                                             solution=None if sudoku == [] else sudoku))
+            else:
+                sys.stdout.write(sudoku_render(sudoku, form) + ("\n" if form == "pipe" else ""))
+        if errors > 0:
+            exit(1)
+    elif mode == Mode.COUNT:
+        form = FLAGS["--format"] or "line"
+        limit = int(args[1])
+        errors = 0
+        for lineno, sudoku in sudoku_stream(sys.stdin if args[2] == "-" else args[2]):
+            if isinstance(sudoku, SudokuFormatError):
+                sys.stderr.write(str(sudoku) + "\n")
+                errors += 1
+                continue
+            count = 0
+            unknown = ""
+            try:
+                for solution in sudoku_solutions(sudoku, limit, FLAGS["--backend"], FLAGS["--preprocess"] == "on",
+                                                 encoding):
+                    count += 1
+                    if FLAGS["--enumerate"] == "on":
+                        if form == "json":
+                            sys.stdout.write(sudoku_json(line=lineno, solution=solution))
+                        else:
+                            sys.stdout.write(sudoku_render(solution, form) + ("\n" if form == "pipe" else ""))
+                        sys.stdout.flush()
+            except SudokuUnknown as e:
+                unknown = str(e)
+                errors += 1
+            if form == "json":
+                record = {"line": lineno, "count": count, "at_least": count == limit or unknown != ""}
+                if unknown:
+                    record["unknown"] = unknown
+                sys.stdout.write(sudoku_json(**record))
+            else:
+                sys.stdout.write("line " + str(lineno) + ": " + ("at least " if count == limit or unknown else "")
+                                 + str(count) + " solution(s)" + (", then unknown: " + unknown if unknown else "")
+                                 + "\n")
+        if errors > 0:
+            exit(1)
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sudokub
+
+# setting the stop event kills the engines of a portfolio solve
+def test_portfolio_stopped():
+    cnf = sudokub.CNF(2)
+    cnf.add_clause((1, 2))
+    stop = threading.Event()
+    threading.Timer(0.2, stop.set).start()
+    start = time.monotonic()
+    with pytest.raises(sudokub.SudokuUnknown):
+        sudokub.sudoku_solve_portfolio(cnf, [("sleep", ["sleep", "60"])], stop)
+    assert time.monotonic() - start < 5
+
+# cancelling an async cdcl solve stops its thread, here on an empty 36x36 grid
+def test_cdcl_cancelled():
+    async def cancelled():
+        task = asyncio.ensure_future(sudokub.sudoku_solve_async([[0] * 36 for _ in range(36)], "cdcl"))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        start = time.monotonic()
+        await asyncio.get_running_loop().shutdown_default_executor()
+        return time.monotonic() - start
+
+    assert asyncio.run(cancelled()) < 5
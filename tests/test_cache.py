@@ -0,0 +1,38 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+import sudokub
+
+def solved(sudoku):
+    cnf, clues = sudokub.sudoku_prepare(sudoku, True)
+    return cnf.board if cnf.nvars == 0 else sudokub.sudoku_session(cnf, "cdcl").solve(clues)
+
+def test_hit(tmp_path):
+    sudoku = sudokub.sudoku_read(os.path.join(HERE, "sudoku9x9", "sudoku00.txt"))
+    solution = solved(sudoku)
+    cache = sudokub.SolutionCache(str(tmp_path / "cache.sqlite"))
+    cache.put(sudoku, solution, [])
+    assert cache.get(sudoku) == (solution, [])
+    cache.close()
+
+# a wrong solution stored in the cache is not answered, and is evicted
+def test_wrong_entry_evicted(tmp_path):
+    sudoku = sudokub.sudoku_read(os.path.join(HERE, "sudoku9x9", "sudoku00.txt"))
+    wrong = solved(sudoku).tolist()
+    wrong[0][0], wrong[0][1] = wrong[0][1], wrong[0][0]
+    cache = sudokub.SolutionCache(str(tmp_path / "cache.sqlite"))
+    cache.put(sudoku, wrong, [])
+    assert cache.get(sudoku) is None
+    assert cache.connection.execute("SELECT COUNT(*) FROM solutions").fetchone()[0] == 0
+    cache.close()
+
+# an "other solution" equal to the solution is as wrong
+def test_wrong_other_evicted(tmp_path):
+    sudoku = sudokub.sudoku_read(os.path.join(HERE, "sudoku9x9", "sudoku00.txt"))
+    solution = solved(sudoku)
+    cache = sudokub.SolutionCache(str(tmp_path / "cache.sqlite"))
+    cache.put(sudoku, solution, solution)
+    assert cache.get(sudoku) is None
+    cache.close()
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+import sudokub
+
+PUZZLES = {4: "sudoku4x4-1.txt", 9: "sudoku9x9/sudoku00.txt", 16: "sudoku16x16/sudoku00.txt"}
+
+# the templates of the run are built in a directory of the test, not next to sudokub.py
+@pytest.fixture(autouse=True)
+def templates(tmp_path, monkeypatch):
+    monkeypatch.setattr(sudokub, "TEMPLATE_DIR", str(tmp_path / "templates"))
+    monkeypatch.setattr(sudokub, "GENERIC_CACHE", {})
+
+# the formula of a puzzle, built clause by clause
+def expected_cnf(sudoku):
+    cnf = sudokub.CNF()
+    sudokub.sudoku_generic_constraints(cnf, len(sudoku), sudokub.sudoku_encoding(len(sudoku)))
+    sudokub.sudoku_specific_constraints(cnf, sudoku)
+    return cnf
+
+@pytest.mark.parametrize("size", sorted(PUZZLES))
+@pytest.mark.parametrize("suffix", [".cnf", ".cnf.gz", ".cnf.xz", ".bin"])
+def test_round_trip(tmp_path, size, suffix):
+    sudoku = sudokub.sudoku_read(os.path.join(HERE, PUZZLES[size]))
+    filename = str(tmp_path / ("puzzle" + suffix))
+    sudokub.sudoku_write_cnf(filename, sudoku)
+    cnf = sudokub.sudoku_read_cnf(filename)
+    expected = expected_cnf(sudoku)
+    assert (cnf.nvars, cnf.nclauses) == (expected.nvars, expected.nclauses)
+    assert list(cnf.literals) == list(expected.literals)
+    if suffix == ".bin":
+        # mapped, not read: the clauses start at the offsets, copy() gives a formula clues can be added to
+        assert isinstance(cnf.literals, memoryview)
+        assert [cnf.literals[cnf.offsets[k + 1] - 1] for k in range(cnf.nclauses)] == [0] * cnf.nclauses
+        copy = cnf.copy()
+        copy.add_clause((1,))
+        assert list(copy.literals) == list(expected.literals) + [1, 0]
+
+def test_binary_version(tmp_path):
+    sudoku = sudokub.sudoku_read(os.path.join(HERE, PUZZLES[4]))
+    filename = str(tmp_path / "puzzle.bin")
+    sudokub.sudoku_write_cnf(filename, sudoku)
+    data = bytearray(open(filename, 'rb').read())
+    data[len(sudokub.CNF_MAGIC):len(sudokub.CNF_MAGIC) + 4] = \
+        (sudokub.CNF_BINARY_VERSION + 1).to_bytes(4, sys.byteorder)
+    open(filename, 'wb').write(bytes(data))
+    with pytest.raises(ValueError):
+        sudokub.sudoku_read_cnf(filename)
+
+def test_binary_truncated(tmp_path):
+    sudoku = sudokub.sudoku_read(os.path.join(HERE, PUZZLES[4]))
+    filename = str(tmp_path / "puzzle.bin")
+    sudokub.sudoku_write_cnf(filename, sudoku)
+    data = open(filename, 'rb').read()
+    open(filename, 'wb').write(data[:-4])
+    with pytest.raises(ValueError):
+        sudokub.sudoku_read_cnf(filename)
@@ -0,0 +1,18 @@
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sudokub
+
+# SolverFactory.createSolverByName(name) calls the static method "new" + name:
+# the name resolves when the class has that method, found as a UTF-8 entry
+# (2-byte length, then the bytes) of its constant pool
+@pytest.mark.parametrize("name", sudokub.PORTFOLIO_SAT4J)
+def test_sat4j_configuration(name):
+    with zipfile.ZipFile(sudokub.SAT4J_JAR) as jar:
+        factory = jar.read("org/sat4j/minisat/SolverFactory.class")
+    method = ("new" + name).encode()
+    assert len(method).to_bytes(2, "big") + method in factory
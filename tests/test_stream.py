@@ -0,0 +1,27 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sudokub
+
+GOOD = ["|1| | | |", "| | | |3|", "| | |2| |", "| |2| | |"]
+
+def records(lines):
+    return [(lineno, isinstance(sudoku, sudokub.SudokuFormatError))
+            for lineno, sudoku in sudokub.sudoku_stream(io.StringIO("\n".join(lines) + "\n"))]
+
+# a bad row in the middle of a grid: the rest of that grid only is skipped
+def test_bad_grid_then_good_grid():
+    bad = ["|1| | | |", "|x| | |3|", "| | |2| |", "| |2| | |"]
+    assert records(bad + GOOD) == [(1, True), (5, False)]
+    assert records(bad + [""] + GOOD) == [(1, True), (6, False)]
+
+# a bad first row: its size gives the number of rows to skip
+def test_bad_first_row():
+    bad = ["|x| | | |", "| | | |3|", "| | |2| |", "| |2| | |"]
+    assert records(bad + GOOD) == [(1, True), (5, False)]
+
+# no size at all: the rows are skipped up to the next line that is not a row
+def test_bad_size():
+    assert records(["|1|2|3|", "|1|2|3|", "", *GOOD, "1..." + "." * 12]) == [(1, True), (4, False), (8, False)]
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sudokub
+
+# stands for SatServer.java: answers the requests of the protocol in order, the
+# first assume with "s UNKNOWN" as after the deadline of a timeout request
+FAKE_SERVER = r'''
+import sys
+answers = [["c timeout", "s UNKNOWN"], ["c conflicts : 3", "s UNSATISFIABLE"],
+           ["s SATISFIABLE", "v 1 -2 0"]]
+for line in sys.stdin:
+    line = line.strip()
+    if line == "quit":
+        break
+    if line == "ping":
+        print("pong")
+    elif line.startswith("assume "):
+        print("\n".join(answers.pop(0)))
+    else:
+        print("ok")
+    print("end")
+    sys.stdout.flush()
+'''
+
+@pytest.fixture
+def worker(tmp_path):
+    server = tmp_path / "server.py"
+    server.write_text(FAKE_SERVER)
+    worker = sudokub.SolverWorker(str(tmp_path))
+    worker.process = subprocess.Popen([sys.executable, str(server)], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, text=True, bufsize=1)
+    yield worker
+    worker.stop()
+
+# an unknown answer is read up to its "end": the next request gets its own answer
+def test_unknown_then_query(worker):
+    with pytest.raises(sudokub.SudokuUnknown):
+        worker.request("assume 1 0", parse=sudokub.sudoku_parse_output)
+    assert worker.request("assume 2 0", parse=sudokub.sudoku_parse_output) == []
+    assert worker.request("assume 3 0") == ["s SATISFIABLE", "v 1 -2 0"]
+    assert worker.ping()
+
+# keeps the formula of its single session, answers "dump" with it
+SESSION_SERVER = r'''
+import sys
+formula = []
+for line in sys.stdin:
+    line = line.strip()
+    if line == "quit":
+        break
+    if line == "ping":
+        print("pong")
+    elif line == "load":
+        header = sys.stdin.readline().split()
+        formula = [[int(lit) for lit in sys.stdin.readline().split()[:-1]] for k in range(int(header[3]))]
+        print("ok")
+    elif line.startswith("add "):
+        formula.append([int(lit) for lit in line.split()[1:-1]])
+        print("ok")
+    elif line.startswith("assume "):
+        print("s UNSATISFIABLE")
+    elif line == "dump":
+        print("c " + repr(formula))
+    print("end")
+    sys.stdout.flush()
+'''
+
+# a session whose formula was replaced by another load is loaded again, with its clauses
+def test_session_reloaded(tmp_path):
+    server = tmp_path / "server.py"
+    server.write_text(SESSION_SERVER)
+    worker = sudokub.SolverWorker(str(tmp_path))
+    worker.process = subprocess.Popen([sys.executable, str(server)], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, text=True, bufsize=1)
+    try:
+        first, second = sudokub.CNF(3), sudokub.CNF(3)
+        first.add_clause((1,))
+        second.add_clause((2,))
+        session = sudokub.WorkerSession(worker, first)
+        session.add_clause((-3,))
+        sudokub.WorkerSession(worker, second)
+        assert worker.request("dump") == ["c [[2]]"]
+        assert session.solve([3]) == []
+        assert worker.request("dump") == ["c [[1], [-3]]"]
+    finally:
+        worker.stop()
+
+# SatServer reads "timeout 0" as no deadline: a timeout below 1 ms is sent as 1 ms
+def test_sub_millisecond_timeout(worker, monkeypatch):
+    sent = []
+    monkeypatch.setattr(worker, "send", sent.append)
+    monkeypatch.setattr(sudokub, "SOLVE_TIMEOUT", 0.0004)
+    worker.deadline()
+    assert sent == ["timeout 1"]